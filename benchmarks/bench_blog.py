@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+# Copyright 2015 Vince Veselosky and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Synthetic large-site benchmarks for the blog domain.
+
+This script generates Sphinx sites full of ``.. blogpost::`` articles, builds
+them with Chephren, and reports how long the main phases of the blog domain
+took, along with peak memory and the size of the pickled environment. Each
+site is built in a fresh child process so that memory figures don't leak
+from one run to the next. Examples::
+
+    python benchmarks/bench_blog.py                       # 1k and 10k posts
+    python benchmarks/bench_blog.py -n 100000 --tags 2000
+    python benchmarks/bench_blog.py -n 10000 --rebuild 10 --json
+
+Timed phases:
+
+process_doc
+    ``BlogDomain.process_doc``, i.e. cataloging and indexing articles.
+generate
+    ``Index.generate`` for every domain index (the archive pages).
+html_page_context
+    ``BlogDomain.on_html_page_context`` for every page written.
+build_finished
+    ``BlogDomain.on_build_finished``, i.e. writing the feeds.
+
+With ``--jobs`` greater than 1, work done in Sphinx's worker processes is
+not timed, so only the totals are comparable with serial builds.
+"""
+from __future__ import print_function
+
+import argparse
+import io
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+WORDS = ('lorem ipsum dolor sit amet consectetur adipisicing elit sed do '
+         'eiusmod tempor incididunt ut labore et dolore magna aliqua enim ad '
+         'minim veniam quis nostrud exercitation ullamco laboris nisi aliquip '
+         'ex ea commodo consequat duis aute irure in reprehenderit voluptate '
+         'velit esse cillum fugiat nulla pariatur excepteur sint occaecat '
+         'cupidatat non proident sunt culpa qui officia deserunt mollit anim '
+         'id est laborum').split()
+
+CONF = u'''\
+extensions = ['chephren.website']
+primary_domain = 'blog'
+project = u'Chephren Benchmark'
+base_url = 'http://localhost:8000'
+master_doc = 'index'
+exclude_patterns = ['_build']
+html_theme = 'basic'
+'''
+
+INDEX = u'''\
+Chephren Benchmark
+==================
+
+.. toctree::
+'''
+
+# Benchmark the working tree, even if chephren is not installed.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PHASES = ('process_doc', 'generate', 'html_page_context', 'build_finished')
+
+
+def words(rng, count):
+    return u' '.join(rng.choice(WORDS) for _ in range(count))
+
+
+def generate_site(srcdir, articles, categories, tags, authors, body_size,
+                  seed=0):
+    """Write a synthetic site with ``articles`` blog posts to ``srcdir``.
+
+    Each post gets one or two of ``categories`` categories, up to five of
+    ``tags`` tags, an author, a description and a body of about
+    ``body_size`` bytes. The same arguments always produce the same site.
+    """
+    rng = random.Random(seed)
+    with io.open(os.path.join(srcdir, 'conf.py'), 'w') as outfile:
+        outfile.write(CONF)
+    with io.open(os.path.join(srcdir, 'index.rst'), 'w') as outfile:
+        outfile.write(INDEX)
+
+    start = datetime(2005, 1, 1)
+    for n in range(articles):
+        when = start + timedelta(minutes=rng.randint(0, 60 * 24 * 365 * 10))
+        dirname = os.path.join(srcdir, 'posts', when.strftime('%Y'))
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        title = words(rng, 5).capitalize()
+        cats = sorted(set('Category %d' % rng.randrange(categories)
+                          for _ in range(rng.randint(1, 2))))
+        tagset = sorted(set('tag%d' % rng.randrange(tags)
+                            for _ in range(rng.randint(0, 5))))
+        paragraphs = []
+        size = 0
+        while size < body_size:
+            paragraph = words(rng, 60)
+            paragraphs.append(paragraph)
+            size += len(paragraph)
+        lines = [title, u'=' * len(title), u'',
+                 u'.. blogpost:: %s' % when.strftime('%Y-%m-%dT%H:%M:00Z'),
+                 u'    :author: Author %d' % rng.randrange(authors),
+                 u'    :category: %s' % u', '.join(cats)]
+        if tagset:
+            lines.append(u'    :tags: %s' % u', '.join(tagset))
+        lines += [u'', u'    ' + words(rng, 25), u'']
+        lines.append(u'\n\n'.join(paragraphs))
+        path = os.path.join(dirname, 'post-%d.rst' % n)
+        with io.open(path, 'w') as outfile:
+            outfile.write(u'\n'.join(lines) + u'\n')
+
+
+def touch_articles(srcdir, count, seed=1):
+    """Append a line to ``count`` existing posts, to force them to be
+    rebuilt."""
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(os.path.join(srcdir,
+                                                             'posts')):
+        paths.extend(os.path.join(dirpath, f) for f in filenames)
+    paths.sort()
+    for path in random.Random(seed).sample(paths, min(count, len(paths))):
+        with io.open(path, 'a') as outfile:
+            outfile.write(u'\nEdited for the benchmark.\n')
+
+
+class PhaseTimer(object):
+    """Wraps the blog domain's entry points to accumulate their run time.
+    """
+
+    def __init__(self):
+        self.seconds = dict((phase, 0.0) for phase in PHASES)
+        self.calls = dict((phase, 0) for phase in PHASES)
+
+    def wrap(self, phase, func):
+        def timed(*args, **kwargs):
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.seconds[phase] += time.time() - start
+                self.calls[phase] += 1
+        return timed
+
+    def install(self):
+        """Patch the domain. This must be done before the Sphinx
+        application is created, since the event handlers are connected
+        when the extension is set up."""
+        from chephren.domain import BlogDomain
+
+        BlogDomain.process_doc = self.wrap('process_doc',
+                                           BlogDomain.process_doc)
+        for index in BlogDomain.indices:
+            index.generate = self.wrap('generate', index.generate)
+        for phase in ('html_page_context', 'build_finished'):
+            name = 'on_' + phase
+            func = BlogDomain.__dict__[name].__func__
+            setattr(BlogDomain, name, staticmethod(self.wrap(phase, func)))
+
+    def reset(self):
+        for phase in PHASES:
+            self.seconds[phase] = 0.0
+            self.calls[phase] = 0
+
+
+def peak_memory_mb():
+    """Return the peak resident set size of this process, in megabytes."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':  # bytes, not kilobytes
+        peak /= 1024
+    return peak / 1024.0
+
+
+def build(srcdir, timer, jobs=1):
+    """Build the site in ``srcdir`` and return the measurements."""
+    from sphinx.application import Sphinx
+
+    outdir = os.path.join(srcdir, '_build', 'html')
+    doctreedir = os.path.join(srcdir, '_build', 'doctrees')
+    timer.reset()
+    start = time.time()
+    app = Sphinx(srcdir, srcdir, outdir, doctreedir, 'html',
+                 status=None, warning=None, parallel=jobs)
+    app.build()
+    result = {'total': time.time() - start}
+    for phase in PHASES:
+        result[phase] = timer.seconds[phase]
+        result[phase + '_calls'] = timer.calls[phase]
+    result['env_pickle_bytes'] = os.path.getsize(
+        os.path.join(doctreedir, 'environment.pickle'))
+    result['peak_memory_mb'] = peak_memory_mb()
+    return result
+
+
+def run_one(args):
+    """Generate and build one site. Runs in a child process."""
+    srcdir = tempfile.mkdtemp(prefix='chephren-bench-')
+    try:
+        start = time.time()
+        generate_site(srcdir, args.articles[0], args.categories, args.tags,
+                      args.authors, args.body_size, args.seed)
+        generated = time.time() - start
+
+        timer = PhaseTimer()
+        timer.install()
+        result = {'articles': args.articles[0], 'generate_site': generated,
+                  'full': build(srcdir, timer, args.jobs)}
+        if args.rebuild:
+            touch_articles(srcdir, args.rebuild)
+            result['rebuild'] = build(srcdir, timer, args.jobs)
+            result['rebuilt_articles'] = args.rebuild
+    finally:
+        if args.keep:
+            print('Site kept in %s' % srcdir, file=sys.stderr)
+        else:
+            shutil.rmtree(srcdir, ignore_errors=True)
+    print(json.dumps(result))
+
+
+def report(result):
+    lines = ['%d articles (site generated in %.1fs)' %
+             (result['articles'], result['generate_site'])]
+    for name in ('full', 'rebuild'):
+        if name not in result:
+            continue
+        r = result[name]
+        label = 'full build' if name == 'full' else \
+            'rebuild after editing %d' % result['rebuilt_articles']
+        lines.append('  %s: %.2fs total, peak memory %s, env pickle %.1f MB' %
+                     (label, r['total'],
+                      '%.0f MB' % r['peak_memory_mb']
+                      if r['peak_memory_mb'] else 'unknown',
+                      r['env_pickle_bytes'] / 1048576.0))
+        for phase in PHASES:
+            lines.append('    %-18s %9.3fs  %8d calls' %
+                         (phase, r[phase], r[phase + '_calls']))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1],
+                                     formatter_class=argparse.
+                                     RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--articles', type=int, nargs='+',
+                        default=[1000, 10000],
+                        help='number of articles per site (default: '
+                             '1000 10000)')
+    parser.add_argument('--categories', type=int, default=20,
+                        help='number of distinct categories (default: 20)')
+    parser.add_argument('--tags', type=int, default=200,
+                        help='number of distinct tags (default: 200)')
+    parser.add_argument('--authors', type=int, default=10,
+                        help='number of distinct authors (default: 10)')
+    parser.add_argument('--body-size', type=int, default=2000,
+                        help='approximate article body size in bytes '
+                             '(default: 2000)')
+    parser.add_argument('--rebuild', type=int, default=0, metavar='N',
+                        help='after the full build, edit N articles and '
+                             'time an incremental rebuild')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Sphinx parallel jobs (default: 1)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--keep', action='store_true',
+                        help='keep the generated sites')
+    parser.add_argument('--json', action='store_true',
+                        help='print results as JSON lines')
+    parser.add_argument('--single', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.single:
+        return run_one(args)
+
+    for count in args.articles:
+        argv = [sys.executable, os.path.abspath(__file__), '--single',
+                '-n', str(count), '--categories', str(args.categories),
+                '--tags', str(args.tags), '--authors', str(args.authors),
+                '--body-size', str(args.body_size),
+                '--rebuild', str(args.rebuild), '--jobs', str(args.jobs),
+                '--seed', str(args.seed)]
+        if args.keep:
+            argv.append('--keep')
+        output = subprocess.check_output(argv).decode('utf-8')
+        result = json.loads(output.strip().splitlines()[-1])
+        print(json.dumps(result) if args.json else report(result))
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
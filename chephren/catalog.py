@@ -0,0 +1,276 @@
+# Copyright 2015 Vince Veselosky and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module contains the metadata-only article catalog.
+
+Article metadata is normally collected by ``BlogDomain.process_doc`` during a
+full Sphinx build. Editorial tools often need only the metadata: what is
+scheduled when, or who wrote what. ``scan`` finds it without Sphinx, by
+looking for the ``blogpost``, ``article`` and ``post`` directives in the
+source files and parsing only their arguments and options, with the same
+rules as ``ArticleDirective``, which shares ``OPTION_SPEC`` with this module.
+
+Results are cached by file modification time and size, so only changed
+files are read again.
+
+This module must not import Sphinx.
+"""
+import io
+import json
+import os
+import re
+from datetime import datetime
+from fnmatch import fnmatch
+
+from dateutil.parser import parse as parse_datetime
+from dateutil.tz import tzoffset, tzutc
+from docutils.parsers.rst import directives
+
+ISO8601_RE = re.compile(
+    r'^(\d{4})-(\d\d)-(\d\d)'
+    r'(?:[T ](\d\d):(\d\d)(?::(\d\d)(?:\.(\d{1,6})\d*)?)?'
+    r'\s*(Z|[+-]\d\d:?\d\d)?)?$'
+)
+
+
+def parse_iso8601(datestr):
+    """Parse a strict ISO 8601 / RFC 3339 date or datetime string.
+
+    This is the fast path for the dates authors normally write. Returns None
+    if the string is not in that format, so the caller can fall back to the
+    slower free-form parser.
+    """
+    match = ISO8601_RE.match(datestr.strip())
+    if not match:
+        return None
+    (year, month, day, hour, minute, second,
+     fraction, offset) = match.groups()
+    thedate = datetime(int(year), int(month), int(day),
+                       int(hour or 0), int(minute or 0), int(second or 0),
+                       int((fraction or '0').ljust(6, '0')))
+    if offset == 'Z':
+        thedate = thedate.replace(tzinfo=tzutc())
+    elif offset:
+        minutes = int(offset[1:3]) * 60 + int(offset[-2:])
+        if offset[0] == '-':
+            minutes = -minutes
+        thedate = thedate.replace(tzinfo=tzoffset(None, minutes * 60))
+    return thedate
+
+
+def split_option(a):
+    """Split a comma separated option value into a list."""
+    return [s.strip() for s in (a or '').split(',') if s.strip()]
+
+
+# The options of the article directives and their conversions.
+OPTION_SPEC = {
+    'author': split_option,
+    'category': split_option,
+    'draft': directives.flag,
+    'image': directives.uri,
+    'language': split_option,
+    'noindex': directives.flag,
+    'tags': split_option,
+}
+
+DIRECTIVE_NAMES = ('blogpost', 'article', 'post')
+
+DIRECTIVE_RE = re.compile(r'^(\s*)\.\.\s+(?:blog:)?(%s)::(.*)$' %
+                          '|'.join(DIRECTIVE_NAMES))
+OPTION_RE = re.compile(r'^:([\w-]+):(.*)$')
+ADORNMENT_RE = re.compile(r'^([!-/:-@\[-`{-~])\1+\s*$')
+
+
+def _indent(line):
+    return len(line) - len(line.lstrip())
+
+
+def find_title(lines):
+    """Return the text of the first section title in ``lines``, or None."""
+    for i in range(len(lines) - 1):
+        text = lines[i].strip()
+        if (text and not lines[i][0].isspace() and
+                not ADORNMENT_RE.match(lines[i]) and
+                ADORNMENT_RE.match(lines[i + 1]) and
+                len(lines[i + 1].rstrip()) >= len(text)):
+            return text
+    return None
+
+
+def parse_source(text):
+    """Return the metadata of the first article directive in the
+    reStructuredText source ``text``, or None if it has none.
+
+    The metadata has the document ``title``, the raw ``date`` argument, the
+    options converted as ``ArticleDirective`` does (those not given have
+    the directive's defaults), and the directive content as
+    ``description``. Raises ValueError if an option value is invalid.
+    """
+    lines = text.splitlines()
+    for start, line in enumerate(lines):
+        match = DIRECTIVE_RE.match(line)
+        if match:
+            break
+    else:
+        return None
+
+    indent = len(match.group(1))
+    meta = {'title': find_title(lines),
+            'date': match.group(3).strip() or None,
+            'author': '', 'category': [], 'image': None, 'language': '',
+            'noindex': False, 'draft': False, 'tags': []}
+    options = {}
+    body = lines[start + 1:]
+    i = 0
+    # The option list is the first block of more indented lines.
+    while i < len(body) and body[i].strip() and _indent(body[i]) > indent:
+        option = OPTION_RE.match(body[i].strip())
+        if option:
+            name, value = option.group(1).lower(), option.group(2).strip()
+            options[name] = value
+        elif options:  # a continuation line
+            options[name] = (options[name] + ' ' + body[i].strip()).strip()
+        else:  # no options; this is the content
+            break
+        i += 1
+    for name, value in options.items():
+        if name not in OPTION_SPEC:
+            raise ValueError('unknown option: %r' % name)
+        try:
+            converted = OPTION_SPEC[name](value or None)
+        except (TypeError, ValueError):
+            raise ValueError('invalid value for option %r: %r' %
+                             (name, value))
+        meta[name] = True if name in ('noindex', 'draft') else converted
+
+    content = []
+    while i < len(body) and (not body[i].strip() or
+                             _indent(body[i]) > indent):
+        content.append(body[i].strip())
+        i += 1
+    meta['description'] = u' '.join(u' '.join(content).split())
+    return meta
+
+
+def parse_date(datestr):
+    """Return a date argument as an ISO 8601 string, or None if it is
+    missing or unparseable. Dates without a time zone stay naive."""
+    if not datestr:
+        return None
+    try:
+        return (parse_iso8601(datestr) or parse_datetime(datestr)).isoformat()
+    except (ValueError, OverflowError):
+        return None
+
+
+class CatalogCache(object):
+    """The catalog entries of source files, keyed by path and validated by
+    modification time and size, kept in a JSON file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.dirty = False
+        if path and os.path.exists(path):
+            try:
+                with io.open(path, encoding='utf-8') as infile:
+                    self.entries = json.load(infile)
+            except ValueError:
+                self.entries = {}
+
+    def get(self, relpath, stat):
+        """Return the cached record for a file, or False if there is none
+        or the file changed. A record of None means no article."""
+        entry = self.entries.get(relpath)
+        if entry and entry[0] == stat.st_mtime and entry[1] == stat.st_size:
+            return entry[2]
+        return False
+
+    def put(self, relpath, stat, record):
+        self.entries[relpath] = [stat.st_mtime, stat.st_size, record]
+        self.dirty = True
+
+    def prune(self, relpaths):
+        """Forget the files not in ``relpaths``."""
+        for relpath in set(self.entries) - set(relpaths):
+            del self.entries[relpath]
+            self.dirty = True
+
+    def save(self):
+        if not self.path or not self.dirty:
+            return
+        tmppath = self.path + '.tmp'
+        with open(tmppath, 'w') as outfile:
+            json.dump(self.entries, outfile, separators=(',', ':'))
+        if os.name == 'nt' and os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(tmppath, self.path)
+        self.dirty = False
+
+
+def find_sources(srcdir, suffixes=('.rst',), exclude=('_build', '.*')):
+    """Yield the paths of the source files under ``srcdir``, relative to it
+    and in sorted order. Files and directories whose names match one of the
+    ``exclude`` patterns are skipped."""
+    suffixes = tuple(suffixes)
+    for dirpath, dirnames, filenames in os.walk(srcdir):
+        dirnames[:] = sorted(d for d in dirnames
+                             if not any(fnmatch(d, p) for p in exclude))
+        for filename in sorted(filenames):
+            if (filename.endswith(suffixes) and
+                    not any(fnmatch(filename, p) for p in exclude)):
+                path = os.path.relpath(os.path.join(dirpath, filename),
+                                       srcdir)
+                yield path.replace(os.sep, '/')
+
+
+def scan(srcdir, suffixes=('.rst',), exclude=('_build', '.*'), cache=None,
+         errors=None):
+    """Yield the catalog record of every article under ``srcdir``.
+
+    A record has the metadata described in ``parse_source``, plus the
+    ``source`` path, the ``docname`` and, if the date could be parsed, the
+    ``datetime`` in ISO 8601 format. ``cache`` is the path of a cache file.
+    Files that cannot be read or parsed are skipped, and reported as
+    ``(path, error)`` pairs to the ``errors`` list if one is given.
+    """
+    store = CatalogCache(cache)
+    seen = []
+    try:
+        for relpath in find_sources(srcdir, suffixes, exclude):
+            seen.append(relpath)
+            path = os.path.join(srcdir, relpath)
+            stat = os.stat(path)
+            record = store.get(relpath, stat)
+            if record is False:
+                try:
+                    with io.open(path, encoding='utf-8-sig') as infile:
+                        meta = parse_source(infile.read())
+                except (IOError, ValueError, UnicodeDecodeError) as e:
+                    if errors is not None:
+                        errors.append((relpath, e))
+                    continue
+                record = None
+                if meta is not None:
+                    record = dict(meta, source=relpath,
+                                  docname=os.path.splitext(relpath)[0],
+                                  datetime=parse_date(meta['date']))
+                store.put(relpath, stat, record)
+            if record is not None:
+                yield record
+        store.prune(seen)
+    finally:
+        store.save()
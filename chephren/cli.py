@@ -0,0 +1,149 @@
+# Copyright 2015 Vince Veselosky and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module contains the ``chephren`` command line tool.
+
+Subcommands:
+
+``chephren catalog SRCDIR``
+    Print the metadata of every article under SRCDIR as JSON Lines, without
+    building the site.
+
+``chephren serve SRCDIR OUTDIR``
+    Build the site into OUTDIR, serve it with live reload, and rebuild it
+    as files under SRCDIR change. See ``chephren.serve``.
+"""
+import argparse
+import json
+import os
+import sys
+from datetime import datetime
+
+from dateutil.tz import tzutc
+
+from . import catalog
+
+EPOCH = datetime(1970, 1, 1, tzinfo=tzutc())
+
+
+def _matches(values, wanted):
+    return not wanted or any(value in wanted for value in values)
+
+
+def _date_key(record):
+    # Compare moments, not strings: 10:00-05:00 is after 12:00+00:00.
+    # Dates without an offset count as UTC. Articles without a date sort
+    # last.
+    when = record['datetime'] and catalog.parse_iso8601(record['datetime'])
+    if when is None:
+        return (True, 0, record['source'])
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=tzutc())
+    return (False, (when - EPOCH).total_seconds(), record['source'])
+
+
+def run_catalog(args):
+    cache = args.cache
+    if cache is None:
+        cache = os.path.join(args.srcdir, '.chephren-catalog.json')
+    errors = []
+    records = catalog.scan(args.srcdir, args.suffix or ['.rst'],
+                           args.exclude or ['_build', '.*'],
+                           cache=cache or None, errors=errors)
+    records = (r for r in records
+               if _matches(r['category'], args.category) and
+               _matches(r['tags'], args.tag) and
+               _matches(r['author'], args.author))
+    if args.sort == 'date':
+        records = sorted(records, reverse=args.reverse, key=_date_key)
+    elif args.reverse:
+        records = reversed(list(records))
+    out = sys.stdout
+    for record in records:
+        out.write(json.dumps(record, sort_keys=True) + '\n')
+    for path, error in errors:
+        sys.stderr.write('%s: %s\n' % (path, error))
+    return 1 if errors else 0
+
+
+def run_serve(args):
+    from .serve import serve
+    serve(args.srcdir, args.outdir, doctreedir=args.doctreedir,
+          confdir=args.confdir, host=args.host, port=args.port,
+          interval=args.interval, parallel=args.jobs)
+    return 0
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        prog='chephren', description='Tools for Chephren blogs.')
+    subparsers = parser.add_subparsers(dest='command')
+
+    sub = subparsers.add_parser(
+        'catalog', help='print the metadata of the articles as JSON Lines')
+    sub.add_argument('srcdir', help='the Sphinx source directory')
+    sub.add_argument('--cache', metavar='PATH',
+                     help='the cache file (default: SRCDIR/'
+                          '.chephren-catalog.json; empty to disable)')
+    sub.add_argument('--suffix', action='append', metavar='SUFFIX',
+                     help='the suffix of source files (default: .rst)')
+    sub.add_argument('--exclude', action='append', metavar='PATTERN',
+                     help='skip files and directories matching PATTERN '
+                          '(default: _build and .*)')
+    sub.add_argument('--category', action='append', metavar='NAME',
+                     help='only articles in category NAME')
+    sub.add_argument('--tag', action='append', metavar='NAME',
+                     help='only articles tagged NAME')
+    sub.add_argument('--author', action='append', metavar='NAME',
+                     help='only articles written by NAME')
+    sub.add_argument('--sort', choices=['source', 'date'], default='source',
+                     help='the order of the articles (default: source)')
+    sub.add_argument('--reverse', action='store_true',
+                     help='reverse the order')
+    sub.set_defaults(func=run_catalog)
+
+    sub = subparsers.add_parser(
+        'serve', help='build, serve and rebuild the site as it changes')
+    sub.add_argument('srcdir', help='the Sphinx source directory')
+    sub.add_argument('outdir', help='the HTML output directory')
+    sub.add_argument('--doctreedir', metavar='PATH',
+                     help='the doctree and environment cache directory '
+                          '(default: OUTDIR/.doctrees)')
+    sub.add_argument('--confdir', metavar='PATH',
+                     help='the directory of conf.py (default: SRCDIR)')
+    sub.add_argument('--host', default='localhost',
+                     help='the address to serve on (default: localhost)')
+    sub.add_argument('--port', type=int, default=8000,
+                     help='the port to serve on (default: 8000)')
+    sub.add_argument('--interval', type=float, default=1.0,
+                     help='seconds between checks for changes '
+                          '(default: 1)')
+    sub.add_argument('-j', '--jobs', type=int, default=0,
+                     help='build in parallel with N processes')
+    sub.set_defaults(func=run_serve)
+    return parser
+
+
+def main(argv=None):
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    if not getattr(args, 'func', None):
+        parser.print_help()
+        return 2
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,157 @@
+# Copyright 2015 Vince Veselosky and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module contains the output precompressor.
+
+Static servers such as nginx (``gzip_static``) can send a ``.gz`` or ``.br``
+file in place of the file requested. ``precompress`` writes those siblings
+for files in the build output, using a pool of processes since compression
+is CPU bound. Each file's content hash is remembered, so files that did not
+change since the last build are not compressed again.
+
+Brotli support needs the optional ``brotli`` package.
+
+This module must not import Sphinx.
+"""
+import gzip
+import hashlib
+import io
+import multiprocessing
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def gzip_compress(data):
+    """Compress bytes with gzip. The header carries no timestamp, so the
+    same content always compresses to the same bytes."""
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=9,
+                       mtime=0) as zipfile:
+        zipfile.write(data)
+    return buf.getvalue()
+
+
+def brotli_compress(data):
+    """Compress bytes with brotli."""
+    return brotli.compress(data)
+
+
+# encoding -> (file suffix, compressor)
+ENCODINGS = {
+    'gzip': ('.gz', gzip_compress),
+    'br': ('.br', brotli_compress),
+}
+
+
+def available(encoding):
+    """Return whether files can be compressed with ``encoding``."""
+    return encoding in ENCODINGS and (encoding != 'br' or brotli is not None)
+
+
+def find_files(root, extensions):
+    """Yield the paths, relative to ``root``, of the files under it whose
+    names end with one of ``extensions``."""
+    extensions = tuple(extensions)
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.endswith(extensions):
+                path = os.path.join(dirpath, filename)
+                yield os.path.relpath(path, root).replace(os.sep, '/')
+
+
+def compress_file(task):
+    """Write the compressed siblings of one file, unless its content hash
+    is the one given and the siblings exist already.
+
+    ``task`` is a ``(path, encodings, digest)`` tuple, so that this can be
+    mapped over a process pool. Returns ``(path, digest, written)``.
+    """
+    path, encodings, digest = task
+    with open(path, 'rb') as infile:
+        data = infile.read()
+    newdigest = hashlib.sha1(data).hexdigest()
+    if newdigest == digest and all(
+            os.path.exists(path + ENCODINGS[e][0]) for e in encodings):
+        return path, newdigest, False
+    for encoding in encodings:
+        suffix, compressor = ENCODINGS[encoding]
+        tmppath = path + suffix + '.tmp'
+        with open(tmppath, 'wb') as outfile:
+            outfile.write(compressor(data))
+        if os.name == 'nt' and os.path.exists(path + suffix):
+            os.remove(path + suffix)
+        os.rename(tmppath, path + suffix)
+    return path, newdigest, True
+
+
+def remove_siblings(root, paths, encodings):
+    """Remove the compressed siblings in ``encodings`` of the files at
+    ``paths`` under ``root``, so that a server cannot send them in place of
+    a newer file. Returns the number of files removed."""
+    removed = 0
+    for path in paths:
+        for encoding in encodings:
+            sibling = os.path.join(root, path + ENCODINGS[encoding][0])
+            if os.path.exists(sibling):
+                os.remove(sibling)
+                removed += 1
+    return removed
+
+
+def prune(root, paths, manifest):
+    """Remove the compressed siblings of the files in ``manifest`` that are
+    not among ``paths`` any more, because they were deleted or no longer
+    match the extensions, and drop them from the manifest. Siblings in
+    every encoding are removed. Returns the number of files removed."""
+    gone = sorted(set(manifest) - set(paths))
+    for path in gone:
+        del manifest[path]
+    return remove_siblings(root, gone, sorted(ENCODINGS))
+
+
+def precompress(root, paths, encodings, manifest, processes=None):
+    """Write compressed siblings of the files at ``paths`` under ``root``.
+
+    ``manifest`` maps each path to the content hash of the file when its
+    siblings were last written, and is updated in place. Siblings of files
+    no longer among ``paths`` are removed. ``processes`` is the size of the
+    process pool, by default the number of CPUs. Returns the number of
+    files compressed.
+    """
+    paths = list(paths)
+    prune(root, paths, manifest)
+    tasks = [(os.path.join(root, path), tuple(encodings), manifest.get(path))
+             for path in paths]
+    if not tasks:
+        return 0
+    if processes == 1 or len(tasks) == 1:
+        results = map(compress_file, tasks)
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(compress_file, tasks, chunksize=16)
+        finally:
+            pool.close()
+            pool.join()
+    written = 0
+    for path, (_, digest, changed) in zip(paths, results):
+        manifest[path] = digest
+        written += changed
+    return written
@@ -36,18 +36,36 @@ we have added the ``archive`` role.
 """
 import os.path
 import codecs
+import json
+import re
+import shutil
+import time
+from bisect import bisect_left, insort
+from heapq import heappop, heappush, merge
+from calendar import timegm
 from collections import namedtuple
+from copy import deepcopy
+from hashlib import sha1
+from datetime import datetime
 from dateutil.parser import parse as parse_datetime
 from docutils import nodes
 
 from pytz import timezone
 from sphinx.domains import Domain, Index, ObjType
-from sphinx.directives import Directive, directives
+from sphinx.directives import Directive
 from sphinx.locale import l_
 from sphinx.roles import XRefRole as SphinxXRefRole
 from sphinx.util.nodes import make_refnode
-from sphinx.util.osutil import ensuredir
-from werkzeug.contrib.atom import AtomFeed
+from sphinx.util.osutil import copyfile, ensuredir
+
+from . import compress, images
+from .catalog import OPTION_SPEC, parse_iso8601
+from .feeds import FEED_FORMATS, FeedEntry, escape, normalize_authors
+from .profiling import NullProfiler, Profiler
+from .search import tokenize, update_shards
+from .related import CATEGORY_WEIGHT, TAG_WEIGHT, find_related, neighborhood
+from .sitemap import SitemapWriter, open_sitemap, shard_filename
+from .store import ContentStore
 
 
 """We create a namedtuple called ``IndexEntry`` for the standard indexing
@@ -66,8 +84,9 @@ class ArticleNode(nodes.Invisible, nodes.Element):
     pass
 
 
-def _split(a):
-    return [s.strip() for s in (a or '').split(',') if s.strip()]
+def epoch_seconds(when):
+    """Convert an aware datetime to integer seconds since the epoch."""
+    return timegm(when.utctimetuple())
 
 
 class ArticleDirective(Directive):
@@ -84,14 +103,7 @@ class ArticleDirective(Directive):
     required_arguments = 0
     optional_arguments = 1
     final_argument_whitespace = True
-    option_spec = {
-        'author': _split,
-        'category': _split,
-        'image': int,
-        'language': _split,
-        'noindex': directives.flag,
-        'tags': _split,
-    }
+    option_spec = OPTION_SPEC
 
     def run(self):
         self.env = self.state.document.settings.env
@@ -105,121 +117,326 @@ class ArticleDirective(Directive):
         node['category'] = self.options.get('category', [])
         node['image'] = self.options.get('image', None)
         node['language'] = self.options.get('language', '')
-        node['noindex'] = self.options.get('noindex', False)
+        # Flags have the value None when given.
+        node['noindex'] = 'noindex' in self.options
+        node['draft'] = 'draft' in self.options
         node['tags'] = self.options.get('tags', [])
 
         return [node]
 
 
-# TODO implement Year, Month, and Date indexes.
-class ChronologicalIndex(Index):
-    name = 'bydate'
-    localname = 'By Date'
-    shortname = 'by date'
+class Article(namedtuple('Article', 'docname title target date updated '
+                                    'description categories tags authors '
+                                    'image')):
+    """The catalog record of one article, stored once in the domain data
+    and referred to from the index buckets by an integer id.
 
-    def add_article(self, article, entry, doctree):
-        """Add an article object to this index. To be called from the
-        domain's ``process_doc`` method.
-        """
-        by_date = self.domain.data['by_date']
+    ``date`` and ``updated`` are integer seconds since the epoch, and
+    ``updated`` is None for articles that were never updated.
+    ``categories``, ``tags`` and ``authors`` are tuples of interned strings.
+    ``image`` is the path of the featured image relative to the source
+    directory, or None.
+    """
+    __slots__ = ()
 
-        if 'updated' in article:
-            when = self.domain.as_datetime(article['updated'])
-        else:
-            when = self.domain.as_datetime(article['date'])
+    @property
+    def timestamp(self):
+        """The time the article is sorted by in the indexes."""
+        return self.date if self.updated is None else self.updated
 
-        datekey = when.strftime('%Y-%m')
-        if datekey in by_date:
-            by_date[datekey].append((when.isoformat(), entry))
-        else:
-            by_date[datekey] = [(when.isoformat(), entry)]
 
-    def sorted_entries(self, pairs, reverse=False):
-        return [
-            e[1] for e in sorted(pairs,
-                                 cmp=lambda a, b: cmp(a[0], b[0]),
-                                 reverse=reverse
-                                 )
-        ]
+def newest_entries(bucket, limit=None):
+    """Return the entries of a sorted bucket, newest first.
+
+    Buckets are lists of ``(timestamp, docname, id)`` entries kept in
+    ascending order, so this walks back from the end of the list one
+    timestamp at a time and costs O(limit) rather than a sort. Articles with
+    the same timestamp stay in ascending docname order, as they were listed
+    when Sphinx read them in that order and they were sorted by date.
+    """
+    result = []
+    end = len(bucket)
+    while end and (limit is None or len(result) < limit):
+        start = bisect_left(bucket, (bucket[end - 1][0],), 0, end)
+        result.extend(bucket[start:end])
+        end = start
+    return result[:limit]
+
+
+def newest_first(bucket, limit=None):
+    """Return the article ids of a sorted bucket, newest first. See
+    ``newest_entries``."""
+    return [entry[-1] for entry in newest_entries(bucket, limit)]
+
+
+def intersect_buckets(buckets):
+    """Return the entries that appear in every one of the sorted ``buckets``,
+    in ascending order.
+
+    Buckets are merged pairwise, smallest first, with a linear walk, so the
+    cost is linear in the total length of the buckets.
+    """
+    buckets = sorted(buckets, key=len)
+    if not buckets:
+        return []
+    result = buckets[0]
+    for bucket in buckets[1:]:
+        merged = []
+        i = j = 0
+        while i < len(result) and j < len(bucket):
+            if result[i] == bucket[j]:
+                merged.append(result[i])
+                i += 1
+                j += 1
+            elif result[i] < bucket[j]:
+                i += 1
+            else:
+                j += 1
+        result = merged
+        if not result:
+            break
+    return result
+
+
+def union_buckets(buckets):
+    """Return the entries that appear in any of the sorted ``buckets``, in
+    ascending order and without duplicates."""
+    result = []
+    for entry in merge(*buckets):
+        if not result or entry != result[-1]:
+            result.append(entry)
+    return result
+
+
+def normalize_names(names):
+    """Return a tuple of the names with whitespace collapsed, without
+    empty names and duplicates, in their first order."""
+    if not isinstance(names, (list, tuple)):
+        names = [names]
+    seen = []
+    for name in names:
+        name = u' '.join((name or u'').split())
+        if name and name not in seen:
+            seen.append(name)
+    return tuple(seen)
+
+
+def slugify(name):
+    """Turn a category, tag or author name into a string safe for file names
+    and URLs, for instance ``'Sphinx Tips'`` into ``'sphinx-tips'``."""
+    return re.sub(r'[^\w]+', '-', name.lower(), flags=re.UNICODE).strip('-')
+
+
+def unique_slugs(names):
+    """Return a dict of a slug for each of ``names``, unique among them.
+
+    Names that slugify alike, such as ``'C++'`` and ``'C'``, would share an
+    output file. The first of them in sorted order keeps the plain slug,
+    and the others get ``-2``, ``-3`` and so on, so each name keeps its file
+    as long as the names that clash with it do not change.
+    """
+    groups = {}
+    for name in sorted(names):
+        groups.setdefault(slugify(name), []).append(name)
+    taken = set(groups)
+    slugs = {}
+    for slug in sorted(groups):
+        number = 1
+        for i, name in enumerate(groups[slug]):
+            if i == 0:
+                slugs[name] = slug
+                continue
+            number += 1
+            while '%s-%d' % (slug, number) in taken:
+                number += 1
+            taken.add('%s-%d' % (slug, number))
+            slugs[name] = '%s-%d' % (slug, number)
+    return slugs
+
+
+def summarize(children):
+    """Aggregate the counts and newest/oldest pointers of calendar nodes."""
+    return {'count': sum(n['count'] for n in children),
+            'newest': max(n['newest'] for n in children),
+            'oldest': min(n['oldest'] for n in children)}
+
+
+class BlogIndex(Index):
+    """Base class of the blog domain's indexes.
+
+    An index files each article into the buckets of the domain data named
+    by its ``bucket_keys`` method. Since the keys are computed from the
+    article record alone, the same method tells ``remove_article`` where to
+    find an article again.
+    """
+
+    def bucket_keys(self, article):
+        """Return the ``(dataname, key)`` pairs of the buckets that hold
+        ``article``. See ``BlogDomain.get_bucket``."""
+        raise NotImplementedError
+
+    def add_article(self, id, article):
+        """Add an article to this index. To be called from the domain's
+        ``add_article`` method.
+        """
+        entry = (article.timestamp, article.docname, id)
+        for dataname, key in self.bucket_keys(article):
+            self.domain.insert_entry(dataname, key, entry)
+
+    def remove_article(self, id, article):
+        """Remove an article from this index. To be called from the
+        domain's ``clear_doc`` method.
+        """
+        entry = (article.timestamp, article.docname, id)
+        for dataname, key in self.bucket_keys(article):
+            self.domain.remove_from_bucket(dataname, key, entry)
+
+    def entries(self, ids):
+        """Return the index entries for a list of article ids."""
+        return [self.domain.index_entry(id) for id in ids]
+
+    def generate_from(self, dataname, reverse=False):
+        """Return the content of an index with one section per bucket of
+        the data named ``dataname``, sorted by key."""
+        with self.domain.profiler.timer(self.name + '.generate'):
+            buckets = self.domain.data[dataname]
+            content = []
+            for key in sorted(buckets, reverse=reverse):
+                ids = newest_first(buckets[key])
+                content.append((key, self.entries(ids)))
+            return (content, True)
+
+
+class ChronologicalIndex(BlogIndex):
+    name = 'bydate'
+    localname = 'By Date'
+    shortname = 'by date'
+
+    def bucket_keys(self, article):
+        when = self.domain.from_epoch(article.timestamp)
+        return [('by_date', when.strftime('%Y-%m')),
+                ('by_day', when.strftime('%Y-%m-%d')),
+                ('timeline', None)]
 
     def generate(self, docnames=None):
         # FIXME implement docnames filter
-        dates = self.domain.data['by_date']
-        entries_for_date = []
-        for date in sorted(dates, reverse=True):
-            entries_for_date.append((date,
-                                     self.sorted_entries(dates[date],
-                                                         reverse=True)))
-        return (entries_for_date, True)
+        return self.generate_from('by_date', reverse=True)
 
     def get_recent(self, limit=25):
         """Return the index entries for the most recent ``limit`` articles."""
-        dates = self.domain.data['by_date']
-        entries = []
-        for date in sorted(dates, reverse=True):
-            for entry in self.sorted_entries(dates[date], reverse=True):
-                entries.append(entry)
-                if len(entries) >= limit:
-                    break
-            else:  # executed if the loop ended normally (no break)
-                continue  # continues the outer loop
-            break  # breaks outer loop if inner loop had break
+        return self.entries(newest_first(self.domain.data['timeline'], limit))
+
+    def get_calendar(self, datekey=None):
+        """Return the calendar node for a year (``'2015'``), a month
+        (``'2015-03'``) or a day (``'2015-03-17'``), or None if there are
+        no articles then. Without a ``datekey``, return all the years.
 
-        return entries
+        A node is a dict with the ``count`` of articles, and the
+        bucket entries of the ``newest`` and ``oldest`` of them.
+        Year nodes have their month nodes in ``months``, and month nodes
+        their day nodes in ``days``. Lookups cost O(1).
+        """
+        calendar = self.domain.data['calendar']
+        if datekey is None:
+            return calendar
+        node = calendar.get(datekey[:4])
+        if node and len(datekey) > 4:
+            node = node['months'].get(datekey[:7])
+        if node and len(datekey) > 7:
+            node = node['days'].get(datekey[:10])
+        return node
+
+    def count(self, datekey):
+        """Return the number of articles in a year, month or day."""
+        node = self.get_calendar(datekey)
+        return node['count'] if node else 0
+
+    def count_pages(self, size):
+        """Return the number of complete pages of ``size`` articles."""
+        return len(self.domain.data['timeline']) // size
+
+    def get_page(self, number, size):
+        """Return the ``(timestamp, docname, id)`` entries of the timeline
+        on page ``number``, newest first.
+
+        Pages are counted from the oldest article, starting at 1, so a
+        complete page keeps the same articles as newer ones are added.
+        """
+        timeline = self.domain.data['timeline']
+        return newest_entries(timeline[(number - 1) * size:number * size])
 
 
-class CategoryIndex(Index):
+class CategoryIndex(BlogIndex):
     name = 'bycategory'
     localname = 'By Category'
     shortname = 'by category'
 
-    def add_article(self, article, entry, doctree):
-        """Add an article object to this index. To be called from the
-        domain's ``process_doc`` method.
-        """
-        if 'category' not in article or not article['category']:
-            return
+    def bucket_keys(self, article):
+        return [('by_category', ixkey) for ixkey in article.categories]
 
-        by_cat = self.domain.data['by_category']
-        if 'updated' in article:
-            when = self.domain.as_datetime(article['updated'])
-        else:
-            when = self.domain.as_datetime(article['date'])
+    def generate(self, docnames=None):
+        # FIXME implement docnames filter
+        return self.generate_from('by_category')
 
-        for ixkey in article['category']:
-            if ixkey in by_cat:
-                by_cat[ixkey].append((when.isoformat(), entry))
-            else:
-                by_cat[ixkey] = [(when.isoformat(), entry)]
+    def get_recent(self, category, limit=25):
+        """Return the index entries for the most recent ``limit`` articles."""
+        return self.entries(newest_first(
+            self.domain.data['by_category'][category], limit))
 
-    def sorted_entries(self, pairs, reverse=False):
-        return [
-            e[1] for e in sorted(pairs,
-                                 cmp=lambda a, b: cmp(a[0], b[0]),
-                                 reverse=reverse
-                                 )
-        ]
+
+class TagIndex(BlogIndex):
+    name = 'bytag'
+    localname = 'By Tag'
+    shortname = 'by tag'
+
+    def bucket_keys(self, article):
+        return [('by_tag', ixkey) for ixkey in article.tags]
 
     def generate(self, docnames=None):
         # FIXME implement docnames filter
-        cats = self.domain.data['by_category']
-        entries_for_cat = []
-        for cat in sorted(cats):
-            entries_for_cat.append((cat,
-                                   self.sorted_entries(cats[cat],
-                                                       reverse=True)))
-        return (entries_for_cat, True)
+        return self.generate_from('by_tag')
 
-    def get_recent(self, category, limit=25):
+    def get_recent(self, tag, limit=25):
         """Return the index entries for the most recent ``limit`` articles."""
-        cats = self.domain.data['by_category']
-        entries = []
-        for entry in self.sorted_entries(cats[category], reverse=True):
-            entries.append(entry)
-            if len(entries) >= limit:
-                break
+        return self.entries(newest_first(self.domain.data['by_tag'][tag],
+                                         limit))
+
+    def query(self, all_tags=(), any_tags=(), limit=None):
+        """Return the index entries for articles tagged with every one of
+        ``all_tags`` and at least one of ``any_tags``, newest first.
+
+        For example, ``query(all_tags=['python', 'sphinx'])`` finds the
+        posts tagged both "python" and "sphinx". The cost is linear in the
+        length of the posting lists of the tags named.
+        """
+        by_tag = self.domain.data['by_tag']
+        buckets = []
+        for tag in all_tags:
+            if tag not in by_tag:
+                return []
+            buckets.append(by_tag[tag])
+        if any_tags:
+            buckets.append(union_buckets(
+                [by_tag[tag] for tag in any_tags if tag in by_tag]))
+        return self.entries(newest_first(intersect_buckets(buckets), limit))
+
+
+class AuthorIndex(BlogIndex):
+    name = 'byauthor'
+    localname = 'By Author'
+    shortname = 'by author'
+
+    def bucket_keys(self, article):
+        return [('by_author', ixkey) for ixkey in article.authors]
+
+    def generate(self, docnames=None):
+        # FIXME implement docnames filter
+        return self.generate_from('by_author')
 
-        return entries
+    def get_recent(self, author, limit=25):
+        """Return the index entries for the most recent ``limit`` articles."""
+        return self.entries(newest_first(
+            self.domain.data['by_author'][author], limit))
 
 
 class BlogDomain(Domain):
@@ -235,40 +452,179 @@ class BlogDomain(Domain):
     roles = {'blogpost': XRefRole(), 'archive': XRefRole()}
 
     # Note: affected by html_domain_indices setting
-    indices = [ChronologicalIndex, CategoryIndex]
+    indices = [ChronologicalIndex, CategoryIndex, TagIndex, AuthorIndex]
 
+    # Articles are stored once, by integer id. Index buckets are lists of
+    # (timestamp, docname, id) entries, always kept sorted. See
+    # ``insert_entry``.
     initial_data = {
-        'articles': {},  # docname -> ixentry
-        'by_date': {},  # date -> date, ixentry
-        'by_category': {},  # category -> date, ixentry
+        'articles': {},  # id -> Article
+        'docids': {},  # docname -> id
+        'next_id': 0,
+        'strings': {},  # interned category, tag and author names
+        'timeline': [],  # every article, one bucket
+        'by_date': {},  # year-month -> bucket
+        'by_day': {},  # year-month-day -> bucket
+        'calendar': {},  # year -> summary, see ChronologicalIndex
+        'by_category': {},  # category -> bucket
+        'by_tag': {},  # tag -> bucket
+        'by_author': {},  # author -> bucket
+        'related': {},  # id -> ids of related articles
+        'related_dirty': set(),  # bucket changes since env-updated
+        'nav_dirty': set(),  # timeline and category changes, likewise
+        'touched': set(),  # docnames read or removed since env-updated
+        'scheduled': [],  # heap of (publish timestamp, docname)
+        'pending': {},  # docname -> Article, not yet published
+        'images': {},  # image path -> derivatives, see chephren.images
     }
+    # Bump whenever the layout of ``initial_data`` changes, so that Sphinx
+    # discards pickled environments written by older versions.
+    data_version = 13
+
+    def __init__(self, env):
+        super(BlogDomain, self).__init__(env)
+        # Sphinx makes only a shallow copy of initial_data for a new
+        # environment. Don't let it share our buckets with the class.
+        if self.data['timeline'] is self.initial_data['timeline']:
+            self.data.update(deepcopy(self.initial_data))
+
+        # Per-build cache for as_datetime. Domain objects are not pickled
+        # with the environment, so this starts empty on every build.
+        self._zone = None
+        self._datetimes = {}
+        self.date_cache_hits = 0
+        self.date_cache_misses = 0
+
+        # Documents read or removed by this build. See on_env_updated.
+        self.changed_docs = set()
+
+        self._profiler = None
+
+    @property
+    def profiler(self):
+        """The build profiler, enabled by the ``profile_filename`` config
+        value. Only work done in the main process is recorded."""
+        if self._profiler is None:
+            config = self.env.config
+            if config.profile_filename:
+                self._profiler = Profiler(config.profile_slowest)
+            else:
+                self._profiler = NullProfiler()
+        return self._profiler
+
+    @property
+    def content_store(self):
+        """The store that holds rendered article bodies for the feeds."""
+        return ContentStore(os.path.join(self.env.doctreedir,
+                                         'chephren-content'))
+
+    @property
+    def title_store(self):
+        """The store that holds rendered article titles for the feeds."""
+        return ContentStore(os.path.join(self.env.doctreedir,
+                                         'chephren-titles'), '.txt')
+
+    @property
+    def term_store(self):
+        """The store that holds the search terms of each article, one per
+        line, for the blog search index."""
+        return ContentStore(os.path.join(self.env.doctreedir,
+                                         'chephren-terms'), '.txt')
+
+    @property
+    def zone(self):
+        """The pytz timezone named by the ``timezone`` config value."""
+        if self._zone is None:
+            self._zone = timezone(self.env.config.timezone)
+        return self._zone
 
     def as_datetime(self, datestr):
-        """Parse a string to produce a timezone-aware datetime."""
-        zone = timezone(self.env.config.timezone)
-        thedate = parse_datetime(datestr)  # raises ValueError on fail
-        # Really, we can't have one function that can deal with both?
-        if thedate.tzinfo:
-            return thedate.astimezone(zone)
-        elif thedate:
-            return zone.localize(thedate)
-
-    def make_index_entry_for(self, docname, doctree):
-        """Generates an IndexEntry structure for a given document."""
+        """Parse a string to produce a timezone-aware datetime.
+
+        Results are memoized by the raw string, since the same date is
+        looked up several times for each article.
+        """
+        with self.profiler.timer('as_datetime'):
+            if datestr in self._datetimes:
+                self.date_cache_hits += 1
+                return self._datetimes[datestr]
+            self.date_cache_misses += 1
+
+            # raises ValueError on fail
+            thedate = parse_iso8601(datestr) or parse_datetime(datestr)
+            # Really, we can't have one function that can deal with both?
+            if thedate.tzinfo:
+                thedate = thedate.astimezone(self.zone)
+            else:
+                thedate = self.zone.localize(thedate)
+            self._datetimes[datestr] = thedate
+            return thedate
+
+    def date_cache_info(self):
+        """Return hit and miss counts for the ``as_datetime`` cache."""
+        return {'hits': self.date_cache_hits,
+                'misses': self.date_cache_misses,
+                'size': len(self._datetimes)}
+
+    def from_epoch(self, timestamp):
+        """Return the datetime in the configured timezone for an integer
+        ``timestamp`` in seconds since the epoch."""
+        return datetime.fromtimestamp(timestamp, self.zone)
+
+    def intern(self, string):
+        """Return the one copy of ``string`` kept in the domain data.
+
+        Category, tag and author names repeat across many articles. Sharing
+        one string object between them all keeps them small in memory, and
+        pickle writes a shared object only once.
+        """
+        return self.data['strings'].setdefault(string, string)
+
+    def make_article_for(self, docname, doctree):
+        """Generates an Article record for a given document."""
         meta = self.env.metadata[docname]
         # FIXME possible to have no title? Metadata overrides?
         title = doctree.next_node(nodes.title).astext()
         target = doctree.next_node(nodes.section)['ids'][0]
+        date = epoch_seconds(self.as_datetime(meta['date']))
         if 'updated' in meta:
-            extra = 'updated ' + \
-                    self.as_datetime(meta['updated']).date().isoformat()
+            updated = epoch_seconds(self.as_datetime(meta['updated']))
         else:
-            extra = self.as_datetime(meta['date']).date().isoformat()
-
-        qualifier = ''
+            updated = None
         description = meta['description'] if 'description' in meta else ''
-        return IndexEntry(title, 0, docname, target,
-                          extra, qualifier, description)
+        return Article(docname, title, target, date, updated, description,
+                       tuple(meta.get('category') or ()),
+                       tuple(meta.get('tags') or ()),
+                       normalize_names(meta.get('author') or ()),
+                       self.resolve_image(docname, meta.get('image')))
+
+    def resolve_image(self, docname, uri):
+        """Return the path, relative to the source directory, of the image
+        ``uri`` given in ``docname``, or None if there is no such file.
+
+        As with Sphinx's ``image`` directive, the path is relative to the
+        document, or to the source directory if it starts with a slash. The
+        document is read again whenever the image changes.
+        """
+        if not uri:
+            return None
+        relpath, path = self.env.relfn2path(uri, docname)
+        if not os.path.isfile(path):
+            self.env.warn(docname, 'featured image not found: %s' % uri)
+            return None
+        self.env.note_dependency(relpath)
+        return relpath.replace(os.sep, '/')
+
+    def index_entry(self, id):
+        """Generates an IndexEntry structure for the article ``id``."""
+        article = self.data['articles'][id]
+        day = self.from_epoch(article.timestamp).date().isoformat()
+        if article.updated is None:
+            extra = day
+        else:
+            extra = 'updated ' + day
+        return IndexEntry(article.title, 0, article.docname, article.target,
+                          extra, '', article.description)
 
     def process_doc(self, env, docname, doctree):
         """Adds documents to the domain indexes.
@@ -278,36 +634,313 @@ class BlogDomain(Domain):
         examine the document for relevant metadata and add it to the catalog.
 
         """
-        env.app.debug("[BLOG] processing doc %s" % docname)
-        article_node = doctree.next_node(ArticleNode)
-        if not article_node:
-            env.app.debug("[BLOG] skipping non-article %s" % docname)
-            return
-
-        # Extract metadata from the doc and stash it in Sphinx's meta.
-        meta = env.metadata[docname]
-        # mark as 'orphan' so that "document isn't included in any toctree"
-        # warning is not issued. Q: can/should we check the toctrees first?
-        meta['orphan'] = True
-        meta['is_article'] = True
-        for metavar, value in article_node.attlist():
-            meta[metavar] = value
-        if 'description' not in meta:
-            meta['description'] = article_node.astext()
-
-        # Create the index entry
-        entry = self.make_index_entry_for(docname, doctree)
-        self.data['articles'][docname] = entry
+        with self.profiler.timer('process_doc', docname):
+            env.app.debug("[BLOG] processing doc %s" % docname)
+            article_node = doctree.next_node(ArticleNode)
+            if not article_node:
+                env.app.debug("[BLOG] skipping non-article %s" % docname)
+                return
+
+            # Extract metadata from the doc and stash it in Sphinx's meta.
+            meta = env.metadata[docname]
+            # mark as 'orphan' so that "document isn't included in any
+            # toctree" warning is not issued. Q: can/should we check the
+            # toctrees first?
+            meta['orphan'] = True
+            meta['is_article'] = True
+            for metavar, value in article_node.attlist():
+                meta[metavar] = value
+            if 'description' not in meta:
+                meta['description'] = article_node.astext()
+
+            article = self.make_article_for(docname, doctree)
+            hidden = meta.get('draft') or meta.get('noindex')
+            if hidden:
+                env.app.debug("[BLOG] not indexing %s" % docname)
+            elif article.date > time.time():
+                self.schedule(article)
+            else:
+                self.add_article(article)
+            if env.config.search_index_dir and not hidden:
+                # Like rendered bodies, terms go to a store rather than the
+                # environment, since this may run in a parallel reader.
+                with self.profiler.timer('search_terms', docname):
+                    terms = tokenize(u' '.join(
+                        (article.title, article.description,
+                         doctree.astext()) +
+                        article.categories + article.tags))
+                    self.term_store.put(docname, u'\n'.join(sorted(terms)))
+
+            # These nodes have no output, just remove them
+            article_node.replace_self([])
+
+    def add_article(self, article):
+        """Store ``article`` under a new id and add it to the indexes."""
+        intern = self.intern
+        article = article._replace(
+            categories=tuple(intern(s) for s in article.categories),
+            tags=tuple(intern(s) for s in article.tags),
+            authors=tuple(intern(s) for s in article.authors))
+        id = self.data['next_id']
+        self.data['next_id'] = id + 1
+        self.data['articles'][id] = article
+        self.data['docids'][article.docname] = id
+        self.data['touched'].add(article.docname)
         for index in self.indices:
             if hasattr(index, 'add_article'):
-                env.app.debug("[BLOG] adding to index %s" % index.name)
-                index(self).add_article(article_node, entry, doctree)
+                # No logging here: this also runs from env-updated, when
+                # Sphinx has already detached env.app.
+                with self.profiler.timer(index.name + '.add_article'):
+                    index(self).add_article(id, article)
+
+    def schedule(self, article):
+        """Hold back a future-dated article until its date has passed.
+        See ``publish_scheduled``."""
+        self.data['pending'][article.docname] = article
+        heappush(self.data['scheduled'], (article.date, article.docname))
+
+    def publish_scheduled(self, now=None):
+        """Add the scheduled articles whose date has passed to the indexes,
+        and return their docnames.
+
+        The heap of scheduled articles is ordered by date, so this only
+        looks at the articles being published. Entries for articles that
+        were removed or rescheduled since are skipped when they come up.
+        """
+        if now is None:
+            now = time.time()
+        scheduled = self.data['scheduled']
+        pending = self.data['pending']
+        published = []
+        while scheduled and scheduled[0][0] <= now:
+            date, docname = heappop(scheduled)
+            article = pending.get(docname)
+            if article is None or article.date != date:
+                continue
+            del pending[docname]
+            self.add_article(article)
+            published.append(docname)
+        return published
+
+    def get_bucket(self, dataname, key, create=False):
+        """Return the bucket stored under ``key`` in the index data named
+        ``dataname``. A ``key`` of None means the data is a single bucket.
+        """
+        buckets = self.data[dataname]
+        if key is None:
+            return buckets
+        if create and key not in buckets:
+            buckets[key] = []
+        return buckets.get(key)
+
+    def insert_entry(self, dataname, key, entry):
+        """Insert an article's ``(timestamp, docname, id)`` entry into the
+        ``key`` bucket of the index data stored under ``dataname``, keeping
+        the bucket sorted by its integer timestamp.
+
+        Articles with the same timestamp sort by docname. Ids are handed out
+        in the order documents are read, which changes when they are read
+        again or in parallel, so they must not decide the order of a page.
+        """
+        bucket = self.get_bucket(dataname, key, create=True)
+        insort(bucket, entry)
+        self.bucket_changed(dataname, key, entry)
+
+    def remove_from_bucket(self, dataname, key, entry):
+        """Remove an article's entry from a bucket in O(log n), dropping the
+        bucket if it becomes empty."""
+        bucket = self.get_bucket(dataname, key)
+        if not bucket:
+            return
+        i = bisect_left(bucket, entry)
+        if i < len(bucket) and bucket[i] == entry:
+            del bucket[i]
+        if not bucket and key is not None:
+            del self.data[dataname][key]
+        self.bucket_changed(dataname, key, entry)
+
+    def bucket_changed(self, dataname, key, entry):
+        """Update the data derived from the buckets after an article's
+        ``entry`` was added to or removed from one."""
+        if dataname == 'by_day':
+            self.update_calendar(key)
+        elif dataname in ('by_category', 'by_tag'):
+            self.data['related_dirty'].add((dataname, key, entry))
+        if dataname in ('timeline', 'by_category'):
+            self.data['nav_dirty'].add((dataname, key, entry))
+
+    def update_calendar(self, daykey):
+        """Refresh the calendar nodes above the ``by_day`` bucket for
+        ``daykey`` after it has changed.
+
+        The day node is read off the ends of its sorted bucket, and the
+        month and year nodes are aggregated from at most 31 days and 12
+        months, so this costs O(1) in the size of the archive.
+        """
+        calendar = self.data['calendar']
+        year, month = daykey[:4], daykey[:7]
+        ynode = calendar.setdefault(year, {'months': {}})
+        mnode = ynode['months'].setdefault(month, {'days': {}})
+
+        bucket = self.data['by_day'].get(daykey)
+        if bucket:
+            mnode['days'][daykey] = {'count': len(bucket),
+                                     'newest': bucket[-1],
+                                     'oldest': bucket[0]}
+        else:
+            mnode['days'].pop(daykey, None)
 
-        # These nodes have no output, just remove them
-        article_node.replace_self([])
+        if mnode['days']:
+            mnode.update(summarize(mnode['days'].values()))
+        else:
+            del ynode['months'][month]
+        if ynode['months']:
+            ynode.update(summarize(ynode['months'].values()))
+        else:
+            del calendar[year]
 
     def clear_doc(self, docname):
-        """TODO clear_doc"""
+        """Removes a document from the catalog and all indexes.
+
+        Sphinx calls this for every document that has changed or been
+        deleted before (re)reading it. Each index computes the buckets that
+        hold the article from its record, so the cost is proportional to
+        the number of buckets touched, not to the size of the indexes.
+        """
+        if self.data['pending'].pop(docname, None):
+            self.term_store.remove(docname)
+        id = self.data['docids'].pop(docname, None)
+        if id is None:
+            return
+        article = self.data['articles'].pop(id)
+        self.data['related'].pop(id, None)
+        for index in self.indices:
+            if hasattr(index, 'remove_article'):
+                index(self).remove_article(id, article)
+        self.content_store.remove(docname)
+        self.title_store.remove(docname)
+        self.term_store.remove(docname)
+        self.data['touched'].add(docname)
+
+    def merge_domaindata(self, docnames, otherdata):
+        """Merge in the data a parallel reader collected for ``docnames``.
+
+        Articles get new ids here, assigned in docname order. Entries are
+        inserted into our buckets by date, then docname, so the result is
+        the same whatever order the workers finish in.
+        """
+        for docname in sorted(docnames):
+            if docname in otherdata['pending']:
+                self.schedule(otherdata['pending'][docname])
+            if docname not in otherdata['docids']:
+                continue
+            self.add_article(
+                otherdata['articles'][otherdata['docids'][docname]])
+
+    def update_related(self, app):
+        """Recompute the related articles of the articles read by this
+        build, and of the articles near them in the tag and category
+        indexes, whose candidates may have changed. See ``chephren.related``.
+
+        Returns the docnames of the articles not read by this build whose
+        related articles changed, so that they are written again.
+        """
+        dirty = self.data['related_dirty']
+        self.data['related_dirty'] = set()
+        related = self.data['related']
+        limit = app.config.related_posts
+        if not limit:
+            related.clear()
+            return []
+
+        with self.profiler.timer('update_related'):
+            docids = self.data['docids']
+            affected = set(docids[docname] for docname in self.changed_docs
+                           if docname in docids)
+            for dataname, key, entry in dirty:
+                bucket = self.data[dataname].get(key)
+                if bucket:
+                    affected.update(neighborhood(bucket, entry))
+
+            rewrite = []
+            for id in sorted(affected):
+                ids = self.compute_related(id, limit)
+                if related.get(id) != ids:
+                    related[id] = ids
+                    docname = self.data['articles'][id].docname
+                    if docname not in self.changed_docs:
+                        rewrite.append(docname)
+            return rewrite
+
+    def compute_related(self, id, limit):
+        """Return the ids of the ``limit`` articles most related to the
+        article ``id``, best first."""
+        article = self.data['articles'][id]
+        by_tag = self.data['by_tag']
+        by_category = self.data['by_category']
+        postings = [(TAG_WEIGHT, by_tag[tag]) for tag in article.tags]
+        postings.extend((CATEGORY_WEIGHT, by_category[category])
+                        for category in article.categories)
+        return find_related((article.timestamp, article.docname, id),
+                            postings, limit)
+
+    def get_related(self, docname):
+        """Return the index entries of the articles related to ``docname``.
+        """
+        id = self.data['docids'].get(docname)
+        return [self.index_entry(other)
+                for other in self.data['related'].get(id, ())]
+
+    def navigation_bucket(self, article, scope):
+        """Return the bucket an article is navigated through: its first
+        category's with a ``scope`` of ``'category'``, else the timeline."""
+        if scope == 'category' and article.categories:
+            return self.data['by_category'].get(article.categories[0], [])
+        return self.data['timeline']
+
+    def get_neighbors(self, docname, scope):
+        """Return the ids of the articles published just before and just
+        after ``docname``, either of which may be None. Found by bisection
+        in the sorted bucket, so this costs O(log n)."""
+        id = self.data['docids'].get(docname)
+        if id is None:
+            return None, None
+        article = self.data['articles'][id]
+        bucket = self.navigation_bucket(article, scope)
+        i = bisect_left(bucket, (article.timestamp, docname, id))
+        if i == len(bucket) or bucket[i][-1] != id:
+            return None, None
+        prev = bucket[i - 1][-1] if i > 0 else None
+        next = bucket[i + 1][-1] if i + 1 < len(bucket) else None
+        return prev, next
+
+    def update_navigation(self, app):
+        """Returns the docnames of the articles not read by this build
+        whose previous or next article may have changed: the neighbors of
+        every place in the timeline, or in a category, where an article was
+        added or removed.
+        """
+        dirty = self.data['nav_dirty']
+        self.data['nav_dirty'] = set()
+        scope = app.config.prev_next
+        if not scope:
+            return []
+        articles = self.data['articles']
+        affected = set()
+        for dataname, key, entry in dirty:
+            if dataname == 'by_category' and scope != 'category':
+                continue
+            bucket = self.get_bucket(dataname, key) or []
+            i = bisect_left(bucket, entry)
+            if i < len(bucket) and bucket[i] == entry:
+                # Added: its old neighbors are now on either side of it.
+                around = bucket[max(i - 1, 0):i] + bucket[i + 1:i + 2]
+            else:
+                # Removed: its old neighbors are now next to each other.
+                around = bucket[max(i - 1, 0):i + 1]
+            affected.update(other[-1] for other in around)
+        return [articles[other].docname for other in sorted(affected)
+                if articles[other].docname not in self.changed_docs]
 
     def resolve_xref(self, env, fromdocname, builder,
                      typ, target, node, contnode):
@@ -317,16 +950,18 @@ class BlogDomain(Domain):
         it calls ``resolve_xref`` so that the domain can resolve the
         reference. If you don't do this correctly, links don't work.
         """
-        builder.app.debug("[BLOG] Asked to resolve %s of type %s from %s" %
-                          (target, typ, fromdocname))
-        if target in self.data['articles']:
-            name = self.data['articles'].title
-            return make_refnode(builder, fromdocname, target, target,
-                                contnode, name)
-        if target.startswith(self.name):  # domain index
-            name = 'By Date'  # FIXME Get name from index class
-            return make_refnode(builder, fromdocname, target, '',
-                                contnode, name)
+        with self.profiler.timer('resolve_xref', fromdocname):
+            builder.app.debug("[BLOG] Asked to resolve %s of type %s from %s" %
+                              (target, typ, fromdocname))
+            if target in self.data['docids']:
+                docid = self.data['docids'][target]
+                name = self.data['articles'][docid].title
+                return make_refnode(builder, fromdocname, target, target,
+                                    contnode, name)
+            if target.startswith(self.name):  # domain index
+                name = 'By Date'  # FIXME Get name from index class
+                return make_refnode(builder, fromdocname, target, '',
+                                    contnode, name)
 
     def resolve_any_xref(self, env, fromdocname, builder, target,
                          node, contnode):
@@ -339,22 +974,27 @@ class BlogDomain(Domain):
                   (node['reftarget'], node['reftype']))
 
     @staticmethod
-    def on_builder_inited(app):
-        """Create the feed container"""
-        feed = AtomFeed(app.config.project,
-                        feed_url=app.config.base_url,
-                        id=app.config.base_url,
-                        )
-        feed.author = app.config.feed_author
-        feed.summary = app.config.project_description
-
-        if app.config.copyright:
-            feed.rights = app.config.copyright
-
-        data = app.env.domaindata[BlogDomain.name]
-        data['mainfeed'] = feed
-        if not hasattr(data, 'feeditems'):
-            data['feeditems'] = {}
+    def on_env_updated(app, env):
+        """Handler for the env-updated event, fired when reading is done.
+
+        First publishes the scheduled articles whose date has passed. Then
+        moves the set of documents touched while reading out of the domain
+        data, so the pickled environment starts the next build with none,
+        and brings the related articles up to date. Returns the articles
+        that must be written again because they were published, or their
+        related, previous or next articles changed.
+        """
+        self = env.domains[BlogDomain.name]
+        published = self.publish_scheduled()
+        self.changed_docs = self.data['touched']
+        self.data['touched'] = set()
+        if app.builder.name == 'html':
+            with self.profiler.timer('update_images'):
+                self.update_images(app)
+        rewrite = set(published)
+        rewrite.update(self.update_related(app))
+        rewrite.update(self.update_navigation(app))
+        return sorted(rewrite)
 
     @staticmethod
     def on_html_page_context(app, pagename, templatename, ctx, doctree):
@@ -370,23 +1010,65 @@ class BlogDomain(Domain):
         if 'is_article' not in metadata:
             return
 
-        item = {'title': ctx.get('title'),
-                'url': app.config.base_url + '/' +
-                ctx['current_page_name'] + ctx['file_suffix'],
-                'content': ctx.get('body'),
-                'updated': self.as_datetime(metadata['date'])
-                }
-        if 'author' in metadata:
-            item['author'] = metadata['author']
-
-        app.env.domaindata[BlogDomain.name]['feeditems'][pagename] = item
-
-        # provide templates with a way to link to the rss output file
-        # FIXME This should be structured the same as next and previous
-        ctx['rss_link'] = app.config.base_url + '/' + app.config.feed_filename
+        with self.profiler.timer('html_page_context', pagename):
+            # The body goes to the content store rather than the
+            # environment. This may run in a parallel writer process, whose
+            # changes to the environment would be lost, but files in the
+            # store are not.
+            self.content_store.put(pagename, ctx.get('body') or u'')
+            # Feeds have always used the title as rendered for the page,
+            # smart quotes and all, rather than the doctree's text.
+            self.title_store.put(pagename, ctx.get('title') or u'')
+
+            ctx['related_posts'] = self.get_related(pagename)
+
+            pathto = ctx.get('pathto')
+            if pathto:
+                ctx['featured_image'] = self.get_featured_image(
+                    pagename, lambda path: pathto(path, 1))
+
+            if metadata.get('draft') or metadata.get('noindex'):
+                ctx['metatags'] = ctx.get('metatags', '') + \
+                    '<meta name="robots" content="noindex" />\n'
+
+            # Articles are orphans, outside any toctree, so Sphinx gives
+            # them no previous and next links. Link the neighbors in the
+            # timeline.
+            if app.config.prev_next:
+                older, newer = self.get_neighbors(pagename,
+                                                  app.config.prev_next)
+                for name, id in (('prev', older), ('next', newer)):
+                    if id is not None:
+                        article = self.data['articles'][id]
+                        ctx[name] = {
+                            'link': app.builder.get_relative_uri(
+                                pagename, article.docname),
+                            'title': escape(article.title),
+                        }
+
+            # provide templates with a way to link to the rss output file
+            # FIXME This should be structured the same as next and previous
+            ctx['rss_link'] = \
+                app.config.base_url + '/' + app.config.feed_filename
 
         app.debug("[SITE] added context for %s" % pagename)
 
+    @staticmethod
+    def on_html_collect_pages(app):
+        """Handler for the html-collect-pages event, which lets us add
+        pages of our own to the HTML output. We add the blog home page and
+        the author pages.
+        """
+        if app.builder.name != 'html':
+            return
+        domain = app.env.domains[BlogDomain.name]
+        if app.config.home_page:
+            for page in domain.collect_home_pages(app):
+                yield page
+        if app.config.author_page:
+            for page in domain.collect_author_pages(app):
+                yield page
+
     @staticmethod
     def on_build_finished(app, exc):
         """Handler for the build-finished event to output atom feeds.
@@ -418,21 +1100,757 @@ class BlogDomain(Domain):
         """
         if app.builder.name != 'html':
             return
-        if not app.config.feed_filename:
-            return
 
         domain = app.env.domains[BlogDomain.name]
-        feed = domain.data['mainfeed']
-        index = ChronologicalIndex(domain)
-        ixentries = index.get_recent()
-        for ix in ixentries:
-            feed.add(**domain.data['feeditems'][ix.docname])
-
-        filepath = os.path.join(app.builder.outdir,
-                                app.config.feed_filename)
+        app.debug("[BLOG] date cache: %(hits)d hits, %(misses)d misses" %
+                  domain.date_cache_info())
+
+        if app.config.feed_filename:
+            with domain.profiler.timer('write_feeds'):
+                domain.write_feeds(app)
+
+        # Even without patterns, to remove the feeds written before.
+        with domain.profiler.timer('write_topic_feeds'):
+            domain.write_topic_feeds(app)
+
+        if app.config.sitemap_filename and not app.config.base_url:
+            # Sitemaps must list absolute URLs.
+            app.warn('base_url is not set, not writing a sitemap')
+        elif app.config.sitemap_filename:
+            with domain.profiler.timer('write_sitemaps'):
+                domain.write_sitemaps(app)
+
+        if app.config.search_index_dir:
+            with domain.profiler.timer('write_search_index'):
+                domain.write_search_index(app)
+
+        # Even without encodings, to remove the files written before.
+        with domain.profiler.timer('precompress'):
+            domain.precompress_output(app)
+
+        if app.config.profile_filename:
+            filepath = os.path.join(app.builder.outdir,
+                                    app.config.profile_filename)
+            ensuredir(os.path.dirname(filepath))
+            domain.profiler.write(filepath,
+                                  date_cache=domain.date_cache_info())
+
+    def write_feeds(self, app):
+        """Write the main feed, and its archive pages if configured."""
+        index = ChronologicalIndex(self)
+        size = app.config.feed_page_size
+        pages = 0
+        links = []
+        if app.config.feed_archive_filename:
+            pages = index.count_pages(size)
+        if pages:
+            links.append(('prev-archive', self.feed_archive_url(app, pages)))
+
+        items = [self.make_feed_item(app, id)
+                 for id in newest_first(self.data['timeline'], size)]
+        BlogDomain.write_feed_file(app, app.config.feed_filename, items,
+                                   links=links)
+        # Even without pages, to remove the pages written before.
+        self.write_feed_archives(app, index, pages)
+
+    def write_topic_feeds(self, app):
+        """Write a feed for every category, tag and author, in one pass.
+
+        Each entry is rendered once and reused by every feed it appears in,
+        and dropped once the last of those feeds is written. The entries of
+        all these feeds have the site's base URL as their ``xml:base`` so
+        that they can be shared. A feed is only rewritten when its entries
+        differ from what was last written, or one of them was read again by
+        this build. Feeds of names that no post has any more, or whose
+        pattern was unset, are removed.
+        """
+        config = app.config
+        size = config.feed_page_size
+        manifest = self.load_manifest('chephren-topicfeeds.json')
+        current = set()
+        outdated = []
+        for dataname, pattern in (
+                ('by_category', config.category_feed_filename),
+                ('by_tag', config.tag_feed_filename),
+                ('by_author', config.author_feed_filename)):
+            if not pattern:
+                continue
+            buckets = self.data[dataname]
+            slugs = unique_slugs(buckets)
+            for key in sorted(buckets):
+                ids = newest_first(buckets[key], size)
+                articles = [self.data['articles'][id] for id in ids]
+                filename = pattern % slugs[key]
+                if slugs[key] != slugify(key):
+                    app.warn('%s %r clashes with another in file names, '
+                             'writing its feed to %s'
+                             % (dataname[3:], key, filename))
+                fingerprint = sha1(repr(
+                    [key, config.feed_formats, config.base_url,
+                     config.feed_author, config.project, config.copyright] +
+                    [(a.timestamp, a.docname, a.title) for a in articles]
+                ).encode('utf-8')).hexdigest()
+                unchanged = self.changed_docs.isdisjoint(a.docname
+                                                         for a in articles)
+                current.add(filename)
+                if (manifest.get(filename) == fingerprint and unchanged and
+                        self.feed_files_exist(app, filename)):
+                    continue
+                outdated.append((filename, key, ids, fingerprint))
+
+        # How many of the feeds to write each entry is still needed for.
+        refcounts = {}
+        for _, _, ids, _ in outdated:
+            for id in ids:
+                docname = self.data['articles'][id].docname
+                refcounts[docname] = refcounts.get(docname, 0) + 1
+        fragments = {}
+        for filename, key, ids, fingerprint in outdated:
+            app.debug("[BLOG] writing feed %s" % filename)
+            feed_url = config.base_url + '/' + filename
+            items = [self.make_feed_item(app, id) for id in ids]
+            BlogDomain.write_feed_file(
+                app, filename, items, feed_url=feed_url, id=feed_url,
+                title=u'%s: %s' % (config.project, key),
+                entry_base=config.base_url, fragments=fragments)
+            manifest[filename] = fingerprint
+            for item in items:
+                docname = item['docname']
+                refcounts[docname] -= 1
+                if not refcounts[docname]:
+                    for format in config.feed_formats:
+                        fragments.pop((format, docname), None)
+
+        self.prune_outputs(app, manifest, current,
+                           lambda name: self.feed_paths(app, name))
+        self.save_manifest('chephren-topicfeeds.json', manifest)
+
+    def feed_archive_url(self, app, number):
+        """Return the URL of archived feed page ``number``."""
+        return app.config.base_url + '/' + \
+            app.config.feed_archive_filename % number
+
+    def write_feed_archives(self, app, index, pages):
+        """Write RFC 5005 archived feed pages.
+
+        An archive page is only rewritten when its entries or links differ
+        from what was last written, or when one of its articles was read
+        again by this build. Fingerprints of the pages written are kept in
+        a file next to the environment pickle. Since page boundaries are
+        fixed, new articles only cause the newest pages to be written. Pages
+        past the last one, after articles were deleted, are removed.
+        """
+        config = app.config
+        manifest = self.load_manifest('chephren-feedpages.json')
+        current = config.base_url + '/' + config.feed_filename
+        filenames = []
+        for number in range(1, pages + 1):
+            page = index.get_page(number, config.feed_page_size)
+            filename = config.feed_archive_filename % number
+            filenames.append(filename)
+            links = [('current', current)]
+            if number > 1:
+                links.append(('prev-archive',
+                              self.feed_archive_url(app, number - 1)))
+            if number < pages:
+                links.append(('next-archive',
+                              self.feed_archive_url(app, number + 1)))
+
+            articles = [self.data['articles'][entry[-1]] for entry in page]
+            fingerprint = sha1(repr(
+                [config.feed_author, config.project, config.copyright] +
+                [(a.timestamp, a.docname, a.title) for a in articles] + links
+            ).encode('utf-8')).hexdigest()
+            unchanged = self.changed_docs.isdisjoint(a.docname
+                                                     for a in articles)
+            if (manifest.get(filename) == fingerprint and unchanged and
+                    os.path.exists(os.path.join(app.builder.outdir,
+                                                filename))):
+                continue
+
+            app.debug("[BLOG] writing feed archive %s" % filename)
+            items = [self.make_feed_item(app, entry[-1]) for entry in page]
+            # RFC 5005 archives are an Atom feature.
+            BlogDomain.write_feed_file(app, filename, items, links=links,
+                                       archive=True, formats=['atom'],
+                                       feed_url=self.feed_archive_url(
+                                           app, number))
+            manifest[filename] = fingerprint
+
+        self.prune_outputs(app, manifest, filenames, lambda name: [
+            os.path.join(app.builder.outdir, name)])
+        self.save_manifest('chephren-feedpages.json', manifest)
+
+    def write_sitemaps(self, app):
+        """Write a sitemap of the articles, split into shards listed by a
+        sitemap index if there are more than ``sitemap_shard_size``.
+
+        Shards hold articles in timeline order, oldest first, so new
+        articles only change the last shard. A shard is only rewritten when
+        the URLs and dates in it differ from what was last written, and
+        shards no longer needed are removed.
+        """
+        config = app.config
+        filename = config.sitemap_filename
+        if config.sitemap_gzip:
+            filename += '.gz'
+        size = config.sitemap_shard_size
+        timeline = self.data['timeline']
+        manifest = self.load_manifest('chephren-sitemaps.json')
+
+        if len(timeline) <= size:
+            shards = [(filename, timeline)]
+        else:
+            shards = [(shard_filename(filename, number + 1),
+                       timeline[start:start + size])
+                      for number, start in enumerate(range(0, len(timeline),
+                                                           size))]
+        for shardname, entries in shards:
+            self.write_sitemap_file(app, manifest, shardname, [
+                (self.article_url(app, id), self.from_epoch(timestamp))
+                for timestamp, _, id in entries])
+        current = [shardname for shardname, _ in shards]
+        if len(shards) > 1:
+            self.write_sitemap_file(app, manifest, filename, [
+                (config.base_url + '/' + shardname,
+                 self.from_epoch(entries[-1][0]))
+                for shardname, entries in shards], index=True)
+            current.append(filename)
+
+        self.prune_outputs(app, manifest, current, lambda name: [
+            os.path.join(app.builder.outdir, name)])
+        self.save_manifest('chephren-sitemaps.json', manifest)
+
+    def write_sitemap_file(self, app, manifest, filename, urls, index=False):
+        """Write ``(loc, lastmod)`` pairs to the sitemap ``filename``,
+        unless the ``manifest`` shows it already holds them."""
+        fingerprint = sha1(repr(
+            [(loc, lastmod.isoformat()) for loc, lastmod in urls]
+        ).encode('utf-8')).hexdigest()
+        filepath = os.path.join(app.builder.outdir, filename)
+        if manifest.get(filename) == fingerprint and os.path.exists(filepath):
+            return
+        app.debug("[BLOG] writing sitemap %s" % filename)
         ensuredir(os.path.dirname(filepath))
-        outfile = codecs.open(filepath, 'w', 'utf-8')
+        with open_sitemap(filepath, app.config.sitemap_gzip) as outfile:
+            sitemap = SitemapWriter(outfile, index=index)
+            sitemap.start()
+            for loc, lastmod in urls:
+                sitemap.write_url(loc, lastmod)
+            sitemap.end()
+        manifest[filename] = fingerprint
+
+    def precompress_output(self, app):
+        """Write compressed siblings of the output files named by
+        ``precompress_extensions``, in the encodings listed in
+        ``precompress``. This runs last, after the feeds and sitemaps have
+        been written. See ``chephren.compress``.
+
+        The manifest records the encodings written, so that when one is
+        no longer listed, or none are, its siblings are removed rather than
+        served in place of newer pages.
+        """
+        encodings = []
+        for encoding in app.config.precompress:
+            if compress.available(encoding):
+                encodings.append(encoding)
+            elif encoding == 'br':
+                app.warn('brotli is not installed, not writing .br files')
+            else:
+                app.warn('unknown precompress encoding %r' % encoding)
+        outdir = app.builder.outdir
+        manifest = self.load_manifest('chephren-compressed.json')
+        files = manifest.get('files', {})
+        dropped = set(manifest.get('encodings', ())) - set(encodings)
+        if dropped:
+            removed = compress.remove_siblings(outdir, sorted(files),
+                                               sorted(dropped))
+            app.debug("[BLOG] removed %d compressed files" % removed)
+        if not encodings:
+            if manifest:
+                self.save_manifest('chephren-compressed.json', {})
+            return
+        paths = compress.find_files(outdir,
+                                    app.config.precompress_extensions)
+        processes = app.parallel if app.parallel > 1 else None
+        written = compress.precompress(outdir, paths, encodings, files,
+                                       processes)
+        app.debug("[BLOG] precompressed %d files" % written)
+        self.save_manifest('chephren-compressed.json',
+                           {'encodings': sorted(encodings), 'files': files})
+
+    def image_dir(self, app):
+        """Return the directory of the featured images in the output."""
+        return os.path.join(app.builder.outdir, app.config.featured_image_dir)
+
+    def update_images(self, app):
+        """Make the derivatives of the featured images of the articles read
+        by this build, and of those whose derivatives are missing from the
+        output. See ``chephren.images``.
+
+        This runs before pages are written, so that templates have the
+        derivatives' URLs and dimensions. Unchanged images are not even
+        read; changed ones get derivatives only for sizes not made before.
+        """
+        known = self.data['images']
+        outdir = self.image_dir(app)
+        before = set(d[0] for derivatives in known.values()
+                     for d in derivatives.values())
+        wanted = set(['original'])
+        if images.available():
+            wanted.update(app.config.featured_image_sizes)
+        used = set()
+        sources = set()
+        for article in self.data['articles'].values():
+            if not article.image:
+                continue
+            used.add(article.image)
+            derivatives = known.get(article.image)
+            if (derivatives is None or
+                    article.docname in self.changed_docs or
+                    not self.derivatives_complete(derivatives, wanted) or
+                    not all(os.path.exists(os.path.join(outdir, d[0]))
+                            for d in derivatives.values())):
+                sources.add(article.image)
+        for image in set(known) - used:
+            del known[image]
+        if sources:
+            if not images.available() and app.config.featured_image_sizes:
+                app.warn('Pillow is not installed, not resizing featured '
+                         'images')
+            processes = app.parallel if app.parallel > 1 else None
+            made, written, errors = images.process_images(
+                [os.path.join(app.srcdir, image)
+                 for image in sorted(sources)],
+                outdir, app.config.featured_image_sizes, processes)
+            for image in sorted(sources):
+                path = os.path.join(app.srcdir, image)
+                known[image] = made[path]
+                if path in errors and app.config.featured_image_sizes:
+                    app.warn('cannot resize featured image %s, using it as '
+                             'it is: %s' % (image, errors[path]))
+            app.debug("[BLOG] wrote %d featured image files" % written)
+
+        # Derivatives are named by content, and may be shared by images
+        # with the same content, so only files no image uses are removed.
+        after = set(d[0] for derivatives in known.values()
+                    for d in derivatives.values())
+        self.prune_outputs(app, dict.fromkeys(before), after,
+                           lambda name: [os.path.join(outdir, name)])
+
+    @staticmethod
+    def derivatives_complete(derivatives, wanted):
+        """Return whether an image has the derivatives ``wanted``. An
+        image Pillow could not read has only its original, with unknown
+        dimensions, and is not tried again until it changes."""
+        if set(derivatives) == wanted:
+            return True
+        original = derivatives.get('original')
+        return (set(derivatives) == set(['original']) and
+                original[1] is None and images.available())
+
+    def get_featured_image(self, docname, url):
+        """Return the derivatives of the featured image of ``docname`` as
+        a dict of ``url``, ``width`` and ``height`` dicts by size name, or
+        None. ``url`` turns a path in the output into a URL."""
+        id = self.data['docids'].get(docname)
+        if id is None:
+            return None
+        derivatives = self.data['images'].get(self.data['articles'][id].image)
+        if not derivatives:
+            return None
+        directory = self.env.config.featured_image_dir
+        return dict((name, {'url': url(directory + '/' + d[0]),
+                            'width': d[1], 'height': d[2]})
+                    for name, d in derivatives.items())
+
+    def write_search_index(self, app):
+        """Bring the sharded blog search index up to date with the articles
+        changed by this build, and copy its client script to ``_static``.
+        See ``chephren.search``.
+
+        The shard keys of each article are kept next to the environment
+        pickle, so an article can be removed from its old shards. If they
+        or the index are missing, every article is indexed again.
+        """
+        root = os.path.join(app.builder.outdir, app.config.search_index_dir)
+        docshards = self.load_manifest('chephren-search.json')
+        if docshards and os.path.isdir(root):
+            changed = self.changed_docs
+        else:
+            if os.path.isdir(root):
+                shutil.rmtree(root)
+            docshards = {}
+            changed = self.data['docids']
+
+        changes = {}
+        for docname in changed:
+            terms = None
+            if docname in self.data['docids']:
+                terms = self.term_store.get(docname)
+            if terms is None:
+                changes[docname] = None
+                continue
+            article = self.data['articles'][self.data['docids'][docname]]
+            changes[docname] = (article.title,
+                                docname + app.builder.out_suffix,
+                                terms.split(u'\n') if terms else [])
+        written = update_shards(root, docshards, changes)
+        app.debug("[BLOG] wrote %d search index shards" % written)
+        self.save_manifest('chephren-search.json', docshards)
+
+        staticdir = os.path.join(app.builder.outdir, '_static')
+        ensuredir(staticdir)
+        copyfile(os.path.join(os.path.dirname(__file__), 'static',
+                              'blogsearch.js'),
+                 os.path.join(staticdir, 'blogsearch.js'))
+
+    def article_url(self, app, id):
+        """Return the absolute URL of the article ``id``."""
+        return app.config.base_url + '/' + \
+            self.data['articles'][id].docname + app.builder.out_suffix
+
+    def load_manifest(self, filename):
+        """Return the fingerprints of generated files kept in ``filename``
+        next to the environment pickle, or an empty dict."""
+        try:
+            with open(os.path.join(self.env.doctreedir, filename)) as infile:
+                return json.load(infile)
+        except (IOError, ValueError):
+            return {}
+
+    def save_manifest(self, filename, manifest):
+        """Save the fingerprints of generated files. See ``load_manifest``.
+        """
+        with open(os.path.join(self.env.doctreedir, filename),
+                  'w') as outfile:
+            json.dump(manifest, outfile)
+
+    def prune_outputs(self, app, manifest, current, paths):
+        """Delete the output files of the names in ``manifest`` that are not
+        in ``current``, and drop them from the manifest.
+
+        Manifests remember what earlier builds wrote, so this finds the
+        files nothing makes any more, such as the last sitemap shard after
+        posts were deleted, without walking the output directory.
+        ``paths`` returns the paths of the files made for a name.
+        """
+        for name in sorted(set(manifest) - set(current)):
+            del manifest[name]
+            for path in paths(name):
+                if os.path.exists(path):
+                    app.debug("[BLOG] removing %s" % path)
+                    os.remove(path)
+
+    @staticmethod
+    def write_feed_file(app, filename, items, formats=None, **kwargs):
+        """Write a feed of ``items`` to ``filename`` in the output directory,
+        in each of the ``formats``, by default those in the ``feed_formats``
+        config value. See ``feed_filenames``. Keyword arguments are passed to
+        ``write_feed``.
+
+        Without ``formats``, files left from formats no longer configured
+        are removed.
+        """
+        domain = app.env.domains[BlogDomain.name]
+        if formats is None:
+            written = [os.path.join(app.builder.outdir, name) for _, name
+                       in BlogDomain.feed_filenames(app, filename)]
+            for path in domain.feed_paths(app, filename):
+                if path not in written and os.path.exists(path):
+                    app.debug("[BLOG] removing %s" % path)
+                    os.remove(path)
+        streams = []
         try:
-            outfile.write(feed.to_string())
+            for format, name in BlogDomain.feed_filenames(app, filename,
+                                                          formats):
+                filepath = os.path.join(app.builder.outdir, name)
+                ensuredir(os.path.dirname(filepath))
+                # The Atom feed URL is passed in, for compatibility with
+                # earlier versions. Other formats link to their own file.
+                feed_url = None
+                if format != 'atom':
+                    feed_url = app.config.base_url + '/' + name
+                streams.append((format, codecs.open(filepath, 'w', 'utf-8'),
+                                feed_url))
+            BlogDomain.write_feed(app, streams, items, domain.content_store,
+                                  **kwargs)
         finally:
-            outfile.close()
+            for _, outfile, _ in streams:
+                outfile.close()
+
+    @staticmethod
+    def feed_filenames(app, filename, formats=None):
+        """Return the ``(format, filename)`` of each format a feed is
+        written in. Atom feeds are written to ``filename`` itself. Other
+        formats replace its extension with their own, so that ``recent.atom``
+        is also written as ``recent.rss`` and ``recent.json``.
+        """
+        result = []
+        for format in formats or app.config.feed_formats:
+            if format not in FEED_FORMATS:
+                app.warn('unknown feed format %r' % format)
+            elif format == 'atom':
+                result.append((format, filename))
+            else:
+                result.append((format, os.path.splitext(filename)[0] +
+                               FEED_FORMATS[format].extension))
+        return result
+
+    def feed_paths(self, app, filename):
+        """Return the output paths of a feed in every format it may have
+        been written in."""
+        return [os.path.join(app.builder.outdir, name) for _, name in
+                self.feed_filenames(app, filename, sorted(FEED_FORMATS))]
+
+    def feed_files_exist(self, app, filename, formats=None):
+        """Return whether a feed has been written in every format."""
+        return all(os.path.exists(os.path.join(app.builder.outdir, name))
+                   for _, name in self.feed_filenames(app, filename, formats))
+
+    def make_feed_item(self, app, id):
+        """Return the feed item for the article ``id``.
+
+        Only the body and the rendered title come from the page writer,
+        through the content and title stores. Everything else is in the
+        environment, so feed items can be made in the main process however
+        the pages were written.
+        """
+        article = self.data['articles'][id]
+        # An article without authors has always had an empty author element.
+        item = {'title': self.title_store.get(article.docname) or
+                article.title,
+                'url': self.article_url(app, id),
+                'docname': article.docname,
+                'updated': self.from_epoch(article.date),
+                'author': list(article.authors) or u'',
+                }
+        derivatives = self.data['images'].get(article.image)
+        if derivatives:
+            filename, _, _, length, type = \
+                derivatives.get('full') or derivatives['original']
+            item['image'] = {
+                'url': '%s/%s/%s' % (app.config.base_url,
+                                     app.config.featured_image_dir, filename),
+                'length': length,
+                'type': type,
+            }
+        return item
+
+    @staticmethod
+    def write_feed(app, streams, items, store, feed_url=None, links=(),
+                   archive=False, title=None, id=None, entry_base=None,
+                   fragments=None):
+        """Stream a feed of ``items`` to each of ``streams``, a list of
+        ``(format, stream, feed_url)`` tuples, all at once. A ``feed_url``
+        of None in a tuple means the ``feed_url`` argument.
+
+        Entries are serialized one at a time, straight to the files, and each
+        body is read from ``store`` only when its entry is written, so the
+        feed is never assembled in memory. Each entry is normalized once as a
+        ``FeedEntry`` for all the formats.
+
+        If a ``fragments`` dict is given, rendered entries are kept in it by
+        format and docname and reused by later feeds sharing the same
+        ``entry_base``.
+        """
+        writers = [(format, FEED_FORMATS[format](
+            stream, title or app.config.project,
+            id=id or app.config.base_url,
+            feed_url=stream_url or feed_url or app.config.base_url,
+            author=app.config.feed_author,
+            rights=app.config.copyright or None,
+            links=links,
+            archive=archive,
+            entry_base=entry_base,
+        )) for format, stream, stream_url in streams]
+        updated = max([item['updated'] for item in items] or [None])
+        entry_authors = all(normalize_authors(item.get('author', ()))
+                            for item in items)
+        for _, writer in writers:
+            writer.start(updated, entry_authors=entry_authors)
+        for item in items:
+            entry = None
+            docname = item['docname']
+            for format, writer in writers:
+                key = (format, docname)
+                if fragments is None or key not in fragments:
+                    if entry is None:
+                        fields = dict(item)
+                        del fields['docname']
+                        entry = FeedEntry(content=store.get(docname),
+                                          **fields)
+                    fragment = writer.render_entry(entry)
+                    if fragments is not None:
+                        fragments[key] = fragment
+                else:
+                    fragment = fragments[key]
+                writer.write_fragment(fragment)
+        for _, writer in writers:
+            writer.end()
+
+    def home_page_name(self, app, number=None):
+        """Return the page name of home page ``number``, or of the first
+        page of the blog home page without one."""
+        if number is None:
+            return app.config.home_page
+        return app.config.home_page_archive % number
+
+    def collect_home_pages(self, app):
+        """Generate the pages of the blog home page for html-collect-pages.
+
+        The home page lists the newest articles, and older ones are listed
+        on numbered pages. Like feed archives, pages are counted from the
+        oldest article, so a complete page keeps its articles, and its URL,
+        as newer ones are added.
+
+        This is a generator, so Sphinx renders each page before the next is
+        made. A page is only rendered again when its articles or links have
+        changed, or one of its articles was read again by this build, or the
+        templates or HTML options changed. Pages past the last one, after
+        articles were deleted, are removed.
+        """
+        index = ChronologicalIndex(self)
+        size = app.config.home_page_size
+        pages = index.count_pages(size)
+        manifest = self.load_manifest('chephren-homepages.json')
+        try:
+            template_mtime = app.builder.templates.newest_template_mtime()
+        except AttributeError:
+            template_mtime = 0
+        # The hash of the html_* options Sphinx keeps in .buildinfo.
+        config_hash = getattr(app.builder, 'config_hash', '')
+
+        home = self.home_page_name(app)
+        ids = newest_first(self.data['timeline'], size)
+        older = self.home_page_name(app, pages) if pages else None
+        yield self.make_home_page(app, home, ids, None, older)
+        for number in range(pages, 0, -1):
+            pagename = self.home_page_name(app, number)
+            if number < pages:
+                newer = self.home_page_name(app, number + 1)
+            else:
+                newer = home
+            if number > 1:
+                older = self.home_page_name(app, number - 1)
+            else:
+                older = None
+            ids = [entry[-1] for entry in index.get_page(number, size)]
+            articles = [self.data['articles'][id] for id in ids]
+            fingerprint = sha1(repr(
+                [(a.timestamp, a.docname, a.title) for a in articles] +
+                [newer, older, template_mtime, config_hash]
+            ).encode('utf-8')).hexdigest()
+            unchanged = self.changed_docs.isdisjoint(a.docname
+                                                     for a in articles)
+            outfile = app.builder.get_outfilename(pagename)
+            if (manifest.get(pagename) == fingerprint and unchanged and
+                    os.path.exists(outfile)):
+                continue
+            app.debug("[BLOG] writing home page %s" % pagename)
+            yield self.make_home_page(app, pagename, ids, newer, older,
+                                      number)
+            manifest[pagename] = fingerprint
+
+        self.prune_outputs(
+            app, manifest,
+            [self.home_page_name(app, n) for n in range(1, pages + 1)],
+            lambda name: [app.builder.get_outfilename(name)])
+        self.save_manifest('chephren-homepages.json', manifest)
+
+    def collect_author_pages(self, app):
+        """Generate a page for every author for html-collect-pages, listing
+        all of the author's articles, newest first.
+
+        Authors are taken from the ``by_author`` buckets in one pass. A page
+        is only rendered again when its articles have changed, or one of
+        them was read again by this build, or the templates or HTML options
+        changed, so adding a post rewrites only the pages of its authors.
+        Pages of authors with no posts left are removed.
+        """
+        manifest = self.load_manifest('chephren-authorpages.json')
+        try:
+            template_mtime = app.builder.templates.newest_template_mtime()
+        except AttributeError:
+            template_mtime = 0
+        config_hash = getattr(app.builder, 'config_hash', '')
+
+        buckets = self.data['by_author']
+        slugs = unique_slugs(buckets)
+        current = []
+        for author in sorted(buckets):
+            pagename = app.config.author_page % slugs[author]
+            current.append(pagename)
+            if slugs[author] != slugify(author):
+                app.warn('author %r clashes with another in file names, '
+                         'writing their page to %s' % (author, pagename))
+            ids = newest_first(buckets[author])
+            articles = [self.data['articles'][id] for id in ids]
+            fingerprint = sha1(repr(
+                [author, template_mtime, config_hash] +
+                [(a.timestamp, a.docname, a.title) for a in articles]
+            ).encode('utf-8')).hexdigest()
+            unchanged = self.changed_docs.isdisjoint(a.docname
+                                                     for a in articles)
+            outfile = app.builder.get_outfilename(pagename)
+            if (manifest.get(pagename) == fingerprint and unchanged and
+                    os.path.exists(outfile)):
+                continue
+            app.debug("[BLOG] writing author page %s" % pagename)
+            pagename, context, _ = self.make_home_page(
+                app, pagename, ids, None, None,
+                title=u'%s: %s' % (app.config.project, author))
+            context['author'] = author
+            yield (pagename, context, app.config.author_page_template)
+            manifest[pagename] = fingerprint
+
+        self.prune_outputs(app, manifest, current,
+                           lambda name: [app.builder.get_outfilename(name)])
+        self.save_manifest('chephren-authorpages.json', manifest)
+
+    def make_home_page(self, app, pagename, ids, newer, older, number=None,
+                       title=None):
+        """Return the ``(pagename, context, templatename)`` of one page of
+        the blog home page, listing the articles ``ids``.
+
+        The context has the index ``entries`` and the relative URIs of the
+        ``newer_page`` and ``older_page``, for custom templates, and a
+        ``body`` of teasers made from the article descriptions, for the
+        theme's ``page.html``. Other listings pass their own ``title``.
+        """
+        uri = app.builder.get_relative_uri
+        entries = [self.index_entry(id) for id in ids]
+        body = [u'<div class="blog-home">\n']
+        for entry in entries:
+            body.append(u'<div class="blog-teaser">\n'
+                        u'<h2><a href="%s">%s</a></h2>\n'
+                        u'<p class="blog-date">%s</p>\n' %
+                        (escape(uri(pagename, entry.docname)),
+                         escape(entry.title), escape(entry.extra)))
+            if entry.description:
+                body.append(u'<p>%s</p>\n' % escape(entry.description))
+            body.append(u'</div>\n')
+        pager = []
+        if newer:
+            pager.append(u'<a href="%s" rel="prev">Newer posts</a>' %
+                         escape(uri(pagename, newer)))
+        if older:
+            pager.append(u'<a href="%s" rel="next">Older posts</a>' %
+                         escape(uri(pagename, older)))
+        if pager:
+            body.append(u'<p class="blog-pager">%s</p>\n' %
+                        u' '.join(pager))
+        body.append(u'</div>\n')
+
+        title = title or app.config.project
+        if number is not None:
+            title = u'%s, page %d' % (title, number)
+        context = {
+            'title': title,
+            'body': u''.join(body),
+            'entries': entries,
+            'page_number': number,
+            'newer_page': newer and uri(pagename, newer),
+            'older_page': older and uri(pagename, older),
+        }
+        return (pagename, context, app.config.home_page_template)
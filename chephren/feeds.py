@@ -0,0 +1,453 @@
+# Copyright 2015 Vince Veselosky and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module contains the feed writers.
+
+Feeds are written to an open stream one entry at a time, so the size of the
+feed never has to fit in memory at once. There is a writer for each format:
+``AtomWriter``, ``RSSWriter`` and ``JSONFeedWriter``, listed by name in
+``FEED_FORMATS``. They all write ``FeedEntry`` records, which format dates
+and escape text once, however many formats are written from them.
+
+The Atom markup produced is the same as that of werkzeug's ``AtomFeed``,
+which Chephren used previously, so that existing feeds do not change under
+subscribers' feet.
+
+This module must not import Sphinx, so it can be used and tested on its own.
+"""
+import json
+from datetime import datetime
+
+# RFC 5005 Feed Paging and Archiving
+HISTORY_NAMESPACE = 'http://purl.org/syndication/history/1.0'
+ATOM_NAMESPACE = 'http://www.w3.org/2005/Atom'
+DC_NAMESPACE = 'http://purl.org/dc/elements/1.1/'
+JSON_FEED_VERSION = 'https://jsonfeed.org/version/1.1'
+
+DAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+          'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+try:
+    string_types = (basestring,)  # noqa
+    text_type = unicode  # noqa
+except NameError:  # Python 3
+    string_types = (str,)
+    text_type = str
+
+
+def escape(s):
+    """Escape a string for use in XML text or attribute values."""
+    if s is None:
+        return ''
+    if not isinstance(s, string_types):
+        s = text_type(s)
+    return s.replace('&', '&amp;').replace('<', '&lt;') \
+        .replace('>', '&gt;').replace('"', '&quot;')
+
+
+def format_iso8601(when):
+    """Format a datetime for Atom. Naive datetimes are treated as UTC."""
+    if when.tzinfo:
+        return when.isoformat()
+    return when.isoformat() + 'Z'
+
+
+def format_rfc822(when):
+    """Format a datetime for RSS. Naive datetimes are treated as UTC."""
+    offset = when.utcoffset() if when.tzinfo else None
+    minutes = int(offset.total_seconds()) // 60 if offset else 0
+    sign = '-' if minutes < 0 else '+'
+    return u'%s, %02d %s %04d %02d:%02d:%02d %s%02d%02d' % (
+        DAYS[when.weekday()], when.day, MONTHS[when.month - 1], when.year,
+        when.hour, when.minute, when.second,
+        sign, abs(minutes) // 60, abs(minutes) % 60)
+
+
+def text_block(name, content, content_type=None, escaped=False):
+    """Return an element holding escaped text, with an optional type.
+    Pass ``escaped`` if ``content`` is escaped already."""
+    if not escaped:
+        content = escape(content)
+    if not content_type:
+        return u'<%s>%s</%s>\n' % (name, content, name)
+    return u'<%s type="%s">%s</%s>\n' % (
+        name, content_type, content, name)
+
+
+def normalize_authors(author):
+    """Turn a name, a dict, or a list of either into a list of dicts with
+    at least a ``name`` key."""
+    if author is None or isinstance(author, string_types + (dict,)):
+        author = [author]
+    return [a if isinstance(a, dict) else {'name': a} for a in author]
+
+
+def _enclosure_attrs(image):
+    """Return the ``type`` and ``length`` attributes of an Atom enclosure
+    link for ``image``, those that are known."""
+    attrs = u''
+    if image.get('type'):
+        attrs += u' type="%s"' % escape(image['type'])
+    if image.get('length'):
+        attrs += u' length="%d"' % image['length']
+    return attrs
+
+
+class FeedEntry(object):
+    """One feed entry, normalized for all the feed writers.
+
+    Dates are formatted and text is escaped at most once, when a writer
+    first needs them, so writing the same entry in several formats costs
+    little more than writing it in one.
+    """
+
+    def __init__(self, title, url, updated, content=None, author=(),
+                 published=None, summary=None, id=None, image=None):
+        self.title = title
+        self.url = url
+        self.id = id or url
+        self.updated = updated
+        self.published = published
+        self.content = content
+        self.summary = summary
+        self.authors = normalize_authors(author)
+        # A dict with the ``url``, and the ``length`` and ``type`` if known.
+        self.image = image
+        self._cache = {}
+
+    def _memo(self, key, func, value):
+        if key not in self._cache:
+            self._cache[key] = func(value)
+        return self._cache[key]
+
+    def escaped(self, name):
+        """Return the attribute ``name`` escaped for XML."""
+        return self._memo(('escaped', name), escape, getattr(self, name))
+
+    def iso8601(self, name):
+        """Return the date attribute ``name`` formatted for Atom and JSON
+        Feed."""
+        return self._memo(('iso8601', name), format_iso8601,
+                          getattr(self, name))
+
+    def rfc822(self, name):
+        """Return the date attribute ``name`` formatted for RSS."""
+        return self._memo(('rfc822', name), format_rfc822,
+                          getattr(self, name))
+
+
+class FeedWriter(object):
+    """Base class of the feed writers, which write a feed to a stream, one
+    entry at a time.
+
+    Call ``start`` once, then ``write_entry`` for each entry, newest first,
+    then ``end``. The stream must accept unicode text, for instance one
+    opened with ``codecs.open``.
+
+    An entry can be rendered once with ``render_entry`` and written to many
+    feeds of the same format with ``write_fragment``. Subclasses implement
+    ``start``, ``render_entry`` and ``end``, and name the file
+    ``extension`` their feeds should have.
+    """
+
+    extension = None
+
+    def __init__(self, stream, title, id=None, feed_url=None, url=None,
+                 author=(), rights=None, subtitle=None, links=(),
+                 archive=False, entry_base=None):
+        self.stream = stream
+        self.title = title
+        self.url = url
+        self.feed_url = feed_url or url
+        self.id = id or self.feed_url
+        self.author = normalize_authors(author) if author else []
+        self.rights = rights
+        self.subtitle = subtitle
+        self.links = links
+        self.archive = archive
+        self.entry_base = entry_base or self.feed_url
+
+    def start(self, updated=None, entry_authors=True):
+        """Write the feed header. ``entry_authors`` is false if some entry
+        has no author."""
+        raise NotImplementedError
+
+    def write_entry(self, title, url, updated, content=None, author=(),
+                    published=None, summary=None, id=None, image=None):
+        """Write one entry."""
+        self.write_fragment(self.render_entry(FeedEntry(
+            title, url, updated, content, author, published, summary, id,
+            image)))
+
+    def render_entry(self, entry):
+        """Return a ``FeedEntry`` rendered as a string."""
+        raise NotImplementedError
+
+    def write_fragment(self, fragment):
+        """Write an entry rendered by ``render_entry``."""
+        self.stream.write(fragment)
+
+    def end(self):
+        """Write the end of the feed."""
+        raise NotImplementedError
+
+
+class AtomWriter(FeedWriter):
+    """Writes an Atom feed.
+
+    ``links`` is a list of ``(rel, href)`` pairs for additional feed links,
+    such as the RFC 5005 ``prev-archive`` link. If ``archive`` is true, the
+    feed is marked as an RFC 5005 archive document. Entries have an
+    ``xml:base`` of ``entry_base``, by default the feed URL, so fragments
+    can only be shared by feeds with the same ``entry_base``.
+    """
+
+    extension = '.atom'
+
+    # werkzeug's AtomFeed named itself as the generator. Keep doing so, so
+    # that feeds written by earlier versions of Chephren are unchanged.
+    generator = ('Werkzeug', None, None)
+
+    def start(self, updated=None, entry_authors=True):
+        """Write the feed header.
+
+        Atom requires an author for every entry, so if the feed has no
+        author of its own and ``entry_authors`` is false (some entry has no
+        author), a placeholder feed author is written.
+        """
+        if not self.author and not entry_authors:
+            self.author = [{'name': 'Unknown author'}]
+        if updated is None:
+            updated = datetime.utcnow()
+
+        write = self.stream.write
+        write(u'<?xml version="1.0" encoding="utf-8"?>\n')
+        if self.archive:
+            write(u'<feed xmlns="%s" xmlns:fh="%s">\n' %
+                  (ATOM_NAMESPACE, HISTORY_NAMESPACE))
+        else:
+            write(u'<feed xmlns="%s">\n' % ATOM_NAMESPACE)
+        write(u'  ' + text_block('title', self.title, 'text'))
+        write(u'  <id>%s</id>\n' % escape(self.id))
+        write(u'  <updated>%s</updated>\n' % format_iso8601(updated))
+        if self.url:
+            write(u'  <link href="%s" />\n' % escape(self.url))
+        if self.feed_url:
+            write(u'  <link href="%s" rel="self" />\n' %
+                  escape(self.feed_url))
+        for rel, href in self.links:
+            write(u'  <link href="%s" rel="%s" />\n' %
+                  (escape(href), escape(rel)))
+        self._write_authors(self.author, u'  ', write)
+        if self.subtitle:
+            write(u'  ' + text_block('subtitle', self.subtitle, 'text'))
+        if self.rights:
+            write(u'  ' + text_block('rights', self.rights))
+        name, uri, version = self.generator
+        tag = u'  <generator'
+        if uri:
+            tag += u' uri="%s"' % escape(uri)
+        if version:
+            tag += u' version="%s"' % escape(version)
+        write(tag + u'>%s</generator>\n' % escape(name))
+        if self.archive:
+            write(u'  <fh:archive />\n')
+
+    def render_entry(self, entry):
+        """Return one ``entry`` element as a string."""
+        parts = []
+        write = parts.append
+        if self.entry_base:
+            write(u'  <entry xml:base="%s">\n' % escape(self.entry_base))
+        else:
+            write(u'  <entry>\n')
+        write(u'    ' + text_block('title', entry.escaped('title'), 'text',
+                                   escaped=True))
+        write(u'    <id>%s</id>\n' % entry.escaped('id'))
+        write(u'    <updated>%s</updated>\n' % entry.iso8601('updated'))
+        if entry.published:
+            write(u'    <published>%s</published>\n' %
+                  entry.iso8601('published'))
+        if entry.url:
+            write(u'    <link href="%s" />\n' % entry.escaped('url'))
+        if entry.image:
+            write(u'    <link href="%s" rel="enclosure"%s />\n' % (
+                escape(entry.image['url']), _enclosure_attrs(entry.image)))
+        self._write_authors(entry.authors, u'    ', write)
+        if entry.summary:
+            write(u'    ' + text_block('summary', entry.escaped('summary'),
+                                       'html', escaped=True))
+        if entry.content:
+            write(u'    ' + text_block('content', entry.escaped('content'),
+                                       'html', escaped=True))
+        write(u'  </entry>\n')
+        return u''.join(parts)
+
+    def end(self):
+        """Write the end of the feed."""
+        self.stream.write(u'</feed>\n')
+
+    def _write_authors(self, authors, indent, write):
+        for author in authors:
+            write(indent + u'<author>\n')
+            write(indent + u'  <name>%s</name>\n' % escape(author['name']))
+            if 'uri' in author:
+                write(indent + u'  <uri>%s</uri>\n' % escape(author['uri']))
+            if 'email' in author:
+                write(indent + u'  <email>%s</email>\n' %
+                      escape(author['email']))
+            write(indent + u'</author>\n')
+
+
+class RSSWriter(FeedWriter):
+    """Writes an RSS 2.0 feed.
+
+    Authors are written as Dublin Core ``creator`` elements, since RSS's
+    own ``author`` element must be an email address. The feed URL is given
+    in an Atom ``self`` link, as the RSS Advisory Board recommends. RFC 5005
+    links and archive documents are Atom only, and are not written.
+    """
+
+    extension = '.rss'
+
+    def start(self, updated=None, entry_authors=True):
+        """Write the feed header."""
+        if updated is None:
+            updated = datetime.utcnow()
+        write = self.stream.write
+        write(u'<?xml version="1.0" encoding="utf-8"?>\n')
+        write(u'<rss version="2.0" xmlns:atom="%s" xmlns:dc="%s">\n' %
+              (ATOM_NAMESPACE, DC_NAMESPACE))
+        write(u'  <channel>\n')
+        write(u'    ' + text_block('title', self.title))
+        write(u'    <link>%s</link>\n' % escape(self.url or self.id))
+        write(u'    ' + text_block('description',
+                                   self.subtitle or self.title))
+        if self.feed_url:
+            write(u'    <atom:link href="%s" rel="self" '
+                  u'type="application/rss+xml" />\n' % escape(self.feed_url))
+        write(u'    <lastBuildDate>%s</lastBuildDate>\n' %
+              format_rfc822(updated))
+        if self.rights:
+            write(u'    ' + text_block('copyright', self.rights))
+        write(u'    <generator>Chephren</generator>\n')
+
+    def render_entry(self, entry):
+        """Return one ``item`` element as a string."""
+        parts = []
+        write = parts.append
+        write(u'    <item>\n')
+        write(u'      <title>%s</title>\n' % entry.escaped('title'))
+        if entry.url:
+            write(u'      <link>%s</link>\n' % entry.escaped('url'))
+        write(u'      <guid isPermaLink="%s">%s</guid>\n' % (
+            'true' if entry.id == entry.url else 'false',
+            entry.escaped('id')))
+        write(u'      <pubDate>%s</pubDate>\n' %
+              entry.rfc822('published' if entry.published else 'updated'))
+        for author in entry.authors:
+            if author['name']:
+                write(u'      <dc:creator>%s</dc:creator>\n' %
+                      escape(author['name']))
+        if entry.content or entry.summary:
+            write(u'      <description>%s</description>\n' %
+                  entry.escaped('content' if entry.content else 'summary'))
+        if entry.image:
+            # RSS requires both attributes.
+            write(u'      <enclosure url="%s" length="%s" type="%s" />\n' % (
+                escape(entry.image['url']),
+                entry.image.get('length') or 0,
+                escape(entry.image.get('type') or
+                       'application/octet-stream')))
+        write(u'    </item>\n')
+        return u''.join(parts)
+
+    def end(self):
+        """Write the end of the feed."""
+        self.stream.write(u'  </channel>\n</rss>\n')
+
+
+class JSONFeedWriter(FeedWriter):
+    """Writes a JSON Feed (version 1.1).
+
+    RFC 5005 links and archive documents are Atom only, and are not
+    written.
+    """
+
+    extension = '.json'
+
+    def start(self, updated=None, entry_authors=True):
+        """Write the feed header, up to the start of the ``items`` list."""
+        feed = {'version': JSON_FEED_VERSION, 'title': self.title}
+        if self.url:
+            feed['home_page_url'] = self.url
+        if self.feed_url:
+            feed['feed_url'] = self.feed_url
+        if self.subtitle:
+            feed['description'] = self.subtitle
+        if self.author:
+            feed['authors'] = self._authors(self.author)
+        header = json.dumps(feed, sort_keys=True)
+        self.stream.write(u'%s, "items": [' % header[:-1])
+        self.first = True
+
+    def render_entry(self, entry):
+        """Return one item object as a string."""
+        item = {'id': entry.id,
+                'title': entry.title,
+                'date_modified': entry.iso8601('updated'),
+                'content_html': entry.content or u''}
+        if entry.url:
+            item['url'] = entry.url
+        if entry.published:
+            item['date_published'] = entry.iso8601('published')
+        if entry.summary:
+            item['summary'] = entry.summary
+        if entry.image:
+            item['image'] = entry.image['url']
+        authors = self._authors(entry.authors)
+        if authors:
+            item['authors'] = authors
+        return u'%s' % json.dumps(item, sort_keys=True)
+
+    def write_fragment(self, fragment):
+        """Write an item rendered by ``render_entry``."""
+        self.stream.write(u'\n  ' if self.first else u',\n  ')
+        self.stream.write(fragment)
+        self.first = False
+
+    def end(self):
+        """Write the end of the feed."""
+        self.stream.write(u'\n]}\n')
+
+    def _authors(self, authors):
+        result = []
+        for author in authors:
+            if not author.get('name'):
+                continue
+            item = {'name': author['name']}
+            if 'uri' in author:
+                item['url'] = author['uri']
+            result.append(item)
+        return result
+
+
+# Feed writers by format name, as used in the ``feed_formats`` config value.
+FEED_FORMATS = {
+    'atom': AtomWriter,
+    'rss': RSSWriter,
+    'json': JSONFeedWriter,
+}
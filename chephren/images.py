@@ -0,0 +1,202 @@
+# Copyright 2015 Vince Veselosky and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module contains the featured image pipeline.
+
+The featured image of an article is copied to the output, along with
+resized derivatives for templates: a thumbnail, a card for social media and
+listings, and a full width version. Derivative file names start with a hash
+of the source image's content, so a derivative that exists already is never
+encoded again, whatever the build, and a changed image gets new URLs that no
+cache can confuse with the old ones. Images are processed in a pool of
+processes, since encoding is CPU bound.
+
+Resizing needs the optional ``Pillow`` package. Without it, only the
+original image is copied, and its dimensions are unknown. The same goes for
+images Pillow cannot read, such as SVG: browsers show them well enough, so
+they are still featured, just not resized.
+
+This module must not import Sphinx.
+"""
+import hashlib
+import mimetypes
+import multiprocessing
+import os
+import shutil
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# name -> (maximum width, maximum height). A height of None means any.
+SIZES = {
+    'thumbnail': (150, 150),
+    'card': (600, 315),
+    'full': (1200, None),
+}
+
+
+def available():
+    """Return whether derivatives can be made."""
+    return Image is not None
+
+
+def file_digest(path):
+    """Return the SHA-1 hash of a file's content."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as infile:
+        for block in iter(lambda: infile.read(65536), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def derivative_name(digest, name, size, ext):
+    """Return the file name of the derivative ``name`` of an image, made
+    to fit within ``size``, or the original if ``size`` is None. The name
+    changes with the image's content and the size."""
+    if size is None:
+        return '%s-%s%s' % (digest[:16], name, ext)
+    width, height = size
+    return '%s-%s-%dx%s%s' % (digest[:16], name, width,
+                              height or '', ext)
+
+
+def image_size(path):
+    """Return the ``(width, height)`` of an image, or ``(None, None)`` if
+    Pillow is not installed. Only the image header is read."""
+    if Image is None:
+        return None, None
+    image = Image.open(path)
+    try:
+        return image.size
+    finally:
+        image.close()
+
+
+def resize(source, dest, size):
+    """Write a copy of the image ``source`` to ``dest``, scaled down to fit
+    within ``size``, a ``(width, height)`` pair. Images are never scaled
+    up."""
+    width, height = size
+    image = Image.open(source)
+    try:
+        format = image.format
+        image.thumbnail((width, height or image.size[1]), Image.LANCZOS)
+        kwargs = {}
+        if format == 'JPEG':
+            kwargs = {'quality': 85, 'optimize': True, 'progressive': True}
+        tmppath = dest + '.tmp'
+        try:
+            image.save(tmppath, format=format, **kwargs)
+        except Exception:
+            if os.path.exists(tmppath):
+                os.remove(tmppath)
+            raise
+    finally:
+        image.close()
+    if os.name == 'nt' and os.path.exists(dest):
+        os.remove(dest)
+    os.rename(tmppath, dest)
+
+
+def make_derivatives(task):
+    """Write the derivatives of one image that do not exist yet.
+
+    ``task`` is a ``(source, outdir, sizes)`` tuple, so that this can be
+    mapped over a process pool. Returns ``(source, derivatives, written,
+    error)`` where ``derivatives`` maps each size name, and ``'original'``,
+    to a ``(filename, width, height, length, type)`` tuple, ``written`` is
+    the number of files encoded or copied, and ``error`` says why the image
+    could not be resized, or is None.
+
+    If Pillow cannot read the image, only the original is copied, with
+    unknown dimensions, rather than failing the build.
+    """
+    source, outdir, sizes = task
+    digest = file_digest(source)
+    ext = os.path.splitext(source)[1].lower()
+    mimetype = mimetypes.guess_type('image' + ext)[0]
+    derivatives = {}
+    written = 0
+    error = None
+
+    filename = derivative_name(digest, 'original', None, ext)
+    dest = os.path.join(outdir, filename)
+    if not os.path.exists(dest):
+        shutil.copyfile(source, dest)
+        written += 1
+    try:
+        width, height = image_size(dest)
+    except (IOError, OSError) as e:
+        width = height = None
+        error = str(e)
+    derivatives['original'] = (filename, width, height,
+                               os.path.getsize(dest), mimetype)
+    if Image is None or error is not None:
+        return source, derivatives, written, error
+
+    for name, size in sorted(sizes.items()):
+        filename = derivative_name(digest, name, size, ext)
+        dest = os.path.join(outdir, filename)
+        try:
+            if not os.path.exists(dest):
+                resize(source, dest, size)
+                written += 1
+            width, height = image_size(dest)
+        except (IOError, OSError) as e:
+            # Keep the original alone rather than a partial set.
+            error = str(e)
+            derivatives = {'original': derivatives['original']}
+            break
+        derivatives[name] = (filename, width, height,
+                             os.path.getsize(dest), mimetype)
+    return source, derivatives, written, error
+
+
+def process_images(sources, outdir, sizes=None, processes=None):
+    """Make the derivatives of the images at the paths ``sources`` in the
+    directory ``outdir``.
+
+    ``processes`` is the size of the process pool, by default the number
+    of CPUs. Returns a dict of the derivatives of each source, as described
+    in ``make_derivatives``, the number of files written, and a dict of the
+    errors of the sources that could not be resized.
+    """
+    if sizes is None:
+        sizes = SIZES
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    tasks = [(source, outdir, sizes) for source in sources]
+    if not tasks:
+        return {}, 0, {}
+    if processes == 1 or len(tasks) == 1:
+        results = map(make_derivatives, tasks)
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(make_derivatives, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    images = {}
+    written = 0
+    errors = {}
+    for source, derivatives, count, error in results:
+        images[source] = derivatives
+        written += count
+        if error is not None:
+            errors[source] = error
+    return images, written, errors
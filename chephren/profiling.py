@@ -0,0 +1,93 @@
+# Copyright 2015 Vince Veselosky and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module contains the build profiler.
+
+When the ``profile_filename`` config value is set, the blog domain times its
+own work with a ``Profiler`` and writes a JSON report to that file in the
+output directory at the end of the build. Otherwise it uses a
+``NullProfiler``, which costs next to nothing.
+
+This module must not import Sphinx.
+"""
+import heapq
+import json
+import time
+from contextlib import contextmanager
+
+
+class NullProfiler(object):
+    """A profiler that records nothing."""
+
+    enabled = False
+
+    @contextmanager
+    def timer(self, name, docname=None):
+        yield
+
+    def record(self, name, seconds, docname=None):
+        pass
+
+
+class Profiler(object):
+    """Accumulates wall time and call counts by phase, and the time spent on
+    each document, across a build.
+    """
+
+    enabled = True
+
+    def __init__(self, slowest=10):
+        self.slowest = slowest
+        self.seconds = {}
+        self.calls = {}
+        self.documents = {}  # docname -> {phase: seconds}
+
+    @contextmanager
+    def timer(self, name, docname=None):
+        """Time the body of a ``with`` block as a call to phase ``name``,
+        charged to ``docname`` if given."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(name, time.time() - start, docname)
+
+    def record(self, name, seconds, docname=None):
+        """Record one call to phase ``name`` that took ``seconds``."""
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if docname is not None:
+            phases = self.documents.setdefault(docname, {})
+            phases[name] = phases.get(name, 0.0) + seconds
+
+    def report(self):
+        """Return the measurements as a dict, ready to be dumped as JSON."""
+        phases = dict((name, {'seconds': self.seconds[name],
+                              'calls': self.calls[name]})
+                      for name in self.seconds)
+        totals = ((sum(p.values()), docname)
+                  for docname, p in self.documents.items())
+        slowest = [{'docname': docname, 'seconds': seconds,
+                    'phases': self.documents[docname]}
+                   for seconds, docname in heapq.nlargest(self.slowest,
+                                                          totals)]
+        return {'phases': phases, 'slowest_documents': slowest}
+
+    def write(self, path, **extra):
+        """Write the report, plus any ``extra`` items, to ``path``."""
+        report = self.report()
+        report.update(extra)
+        with open(path, 'w') as outfile:
+            json.dump(report, outfile, indent=2, sort_keys=True)
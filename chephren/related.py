@@ -0,0 +1,75 @@
+# Copyright 2015 Vince Veselosky and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module contains the related posts engine.
+
+Comparing every article with every other is quadratic in the size of the
+blog. Instead, candidates for an article are drawn from the posting lists of
+its own tags and categories: the sorted ``(timestamp, docname, id)`` buckets
+of the blog domain's indexes. Only the ``WINDOW`` articles on either side of
+the article in each list are considered, so the cost per article is bounded
+no matter how popular a category is, and the candidates are close in time.
+
+Candidates score ``TAG_WEIGHT`` for every tag and ``CATEGORY_WEIGHT`` for
+every category they share with the article. Ties go to the article closest
+in time, then to the first by docname.
+
+This module must not import Sphinx.
+"""
+from bisect import bisect_left
+from heapq import nsmallest
+
+# How many articles on each side of an article in a posting list are
+# candidates for its related articles.
+WINDOW = 20
+
+TAG_WEIGHT = 2
+CATEGORY_WEIGHT = 1
+
+
+def window(bucket, entry, size=WINDOW):
+    """Return the items of a sorted bucket within ``size`` positions of
+    where ``entry`` is, or would be, in it."""
+    i = bisect_left(bucket, entry)
+    return bucket[max(i - size, 0):i + size + 1]
+
+
+def find_related(entry, postings, limit):
+    """Return the ids of the ``limit`` articles most related to the article
+    ``entry``, a ``(timestamp, docname, id)``, best first.
+
+    ``postings`` is a list of ``(weight, bucket)`` pairs, one for each of
+    the article's tags and categories.
+    """
+    scores = {}
+    for weight, bucket in postings:
+        for other in window(bucket, entry):
+            if other != entry:
+                scores[other] = scores.get(other, 0) + weight
+    timestamp = entry[0]
+    best = nsmallest(limit, scores, key=lambda other: (
+        -scores[other], abs(other[0] - timestamp), other[1]))
+    return tuple(other[-1] for other in best)
+
+
+def neighborhood(bucket, entry):
+    """Return the ids of the articles whose related articles may change
+    when ``entry`` is added to or removed from ``bucket``.
+
+    These are the articles whose window could include ``entry``, plus one
+    more on each side, since adding or removing an item shifts the windows
+    around it by one place.
+    """
+    return [other[-1] for other in window(bucket, entry, WINDOW + 1)]
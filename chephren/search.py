@@ -0,0 +1,140 @@
+# Copyright 2015 Vince Veselosky and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module contains the sharded search index for blog articles.
+
+Sphinx's ``searchindex.js`` holds every term of every document in one file,
+which every visitor who searches must download. The blog search index is
+instead split into shards by the first characters of each term, one JSON
+file per shard, and ``blogsearch.js`` fetches only the shards for the terms
+of a query.
+
+A shard maps each of its terms to the docnames of the articles containing
+it, and each of those docnames to the title and URL of the article::
+
+    {"terms": {"sphinx": ["posts/a", "posts/b"]},
+     "docs": {"posts/a": ["A post", "posts/a.html"], ...}}
+
+Shards are updated in place: only the shards holding terms of changed
+articles are read and written again.
+
+This module must not import Sphinx.
+"""
+import binascii
+import errno
+import io
+import json
+import os
+import re
+
+# Terms are sharded by this many leading characters.
+PREFIX_LENGTH = 2
+
+# A term is a run of two or more letters or digits, in any script. This is
+# [\p{L}\p{N}]{2,} in blogsearch.js, which must find the same terms.
+WORD_RE = re.compile(r'[^\W_]{2,}', re.UNICODE)
+
+STOPWORDS = frozenset(u'''
+an and are as at be but by for from has have he her his if in into is it
+its no not of on or she so such than that the their them then there these
+they this to was we were which will with you your
+'''.split())
+
+
+def tokenize(text):
+    """Return the set of search terms in ``text``."""
+    return set(word for word in WORD_RE.findall(text.lower())
+               if word not in STOPWORDS)
+
+
+def shard_key(term, length=PREFIX_LENGTH):
+    """Return the key of the shard that holds ``term``."""
+    return term[:length]
+
+
+def shard_filename(key):
+    """Return the file name of a shard. Keys are hex encoded, so that any
+    characters are safe in file names and URLs."""
+    return binascii.hexlify(key.encode('utf-8')).decode('ascii') + '.json'
+
+
+def _load(path):
+    try:
+        with io.open(path, encoding='utf-8') as infile:
+            return json.load(infile)
+    except IOError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return None
+
+
+def update_shards(root, docshards, changes, length=PREFIX_LENGTH):
+    """Apply ``changes`` to the shards in the directory ``root``.
+
+    ``changes`` maps docnames to None, for articles that were removed, or to
+    a ``(title, url, terms)`` tuple. ``docshards`` maps each docname to the
+    keys of the shards that hold it, and is updated in place. Only the
+    shards that held, or now hold, a changed article are read and written,
+    one at a time. Returns the number of shards written.
+    """
+    removals = {}  # key -> docnames
+    additions = {}  # key -> {docname: (title, url, terms)}
+    for docname, doc in changes.items():
+        for key in docshards.pop(docname, ()):
+            removals.setdefault(key, set()).add(docname)
+        if doc is None:
+            continue
+        title, url, terms = doc
+        byshard = {}
+        for term in terms:
+            byshard.setdefault(shard_key(term, length), []).append(term)
+        docshards[docname] = sorted(byshard)
+        for key, shardterms in byshard.items():
+            additions.setdefault(key, {})[docname] = (title, url, shardterms)
+
+    if not os.path.isdir(root):
+        os.makedirs(root)
+    written = 0
+    for key in sorted(set(removals) | set(additions)):
+        path = os.path.join(root, shard_filename(key))
+        shard = _load(path) or {'terms': {}, 'docs': {}}
+        terms, docs = shard['terms'], shard['docs']
+        gone = removals.get(key)
+        if gone:
+            for docname in gone:
+                docs.pop(docname, None)
+            for term in list(terms):
+                terms[term] = [d for d in terms[term] if d not in gone]
+                if not terms[term]:
+                    del terms[term]
+        added = set()
+        for docname, (title, url, shardterms) in \
+                additions.get(key, {}).items():
+            docs[docname] = [title, url]
+            for term in shardterms:
+                terms.setdefault(term, []).append(docname)
+            added.update(shardterms)
+        for term in added:
+            terms[term].sort()
+
+        if docs:
+            with open(path, 'wb') as outfile:
+                outfile.write(json.dumps(shard, sort_keys=True,
+                                         separators=(',', ':')
+                                         ).encode('ascii'))
+        elif os.path.exists(path):
+            os.remove(path)
+        written += 1
+    return written
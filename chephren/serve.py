@@ -0,0 +1,209 @@
+# Copyright 2015 Vince Veselosky and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module contains the development server behind ``chephren serve``.
+
+The server builds the site once, serves the output over HTTP, and polls the
+source directory for changes. On a change it runs an incremental Sphinx
+build in the same process: Sphinx reads only the changed documents, and the
+blog domain works out from its index buckets which archive pages, feeds and
+listings hold them, and rewrites only those. Pages served as HTML get a
+small script that reloads them when a build finishes.
+
+Sphinx is imported only when a build runs, so the rest of the command line
+tool works without it.
+"""
+import os
+import sys
+import threading
+import time
+from fnmatch import fnmatch
+
+try:
+    from http.server import HTTPServer, SimpleHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError:  # Python 2
+    from BaseHTTPServer import HTTPServer
+    from SimpleHTTPServer import SimpleHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+
+# The path the reload script polls for the number of the latest build.
+RELOAD_PATH = '/_chephren/build'
+
+RELOAD_SCRIPT = u'''<script>
+(function () {
+  var build = null;
+  function poll() {
+    var request = new XMLHttpRequest();
+    request.open('GET', '%s');
+    request.onload = function () {
+      if (build !== null && request.responseText !== build) {
+        location.reload();
+      }
+      build = request.responseText;
+      setTimeout(poll, 1000);
+    };
+    request.onerror = function () { setTimeout(poll, 2000); };
+    request.send();
+  }
+  poll();
+})();
+</script>
+''' % RELOAD_PATH
+
+
+def inject_reload_script(html):
+    """Return the bytes of an HTML page with the reload script added at the
+    end of its body."""
+    script = RELOAD_SCRIPT.encode('utf-8')
+    i = html.rfind(b'</body>')
+    if i < 0:
+        return html + script
+    return html[:i] + script + html[i:]
+
+
+def snapshot(root, exclude=('_build', '.*')):
+    """Return the modification time and size of every file under ``root``,
+    by path. Files and directories whose names match one of the ``exclude``
+    patterns are skipped."""
+    files = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames
+                       if not any(fnmatch(d, p) for p in exclude)]
+        for filename in filenames:
+            if any(fnmatch(filename, p) for p in exclude):
+                continue
+            path = os.path.join(dirpath, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:  # removed while we looked
+                continue
+            files[path] = (stat.st_mtime, stat.st_size)
+    return files
+
+
+def changed_files(before, after):
+    """Return the sorted paths added, removed or changed between two
+    snapshots."""
+    return sorted(path for path in set(before) | set(after)
+                  if before.get(path) != after.get(path))
+
+
+def build(srcdir, outdir, doctreedir, confdir=None, parallel=0):
+    """Run an incremental HTML build with Sphinx. Returns True if it
+    succeeded."""
+    from sphinx.application import Sphinx
+    try:
+        app = Sphinx(srcdir, confdir or srcdir, outdir, doctreedir, 'html',
+                     parallel=parallel)
+        app.build()
+    except Exception as e:
+        sys.stderr.write('Build failed: %s\n' % e)
+        return False
+    return app.statuscode == 0
+
+
+class ReloadHandler(SimpleHTTPRequestHandler):
+    """Serves the build output, adding the reload script to HTML pages."""
+
+    # Set on the subclass made by ``make_server``.
+    root = None
+    state = None
+
+    def translate_path(self, path):
+        # Serve from the output directory rather than the working one.
+        path = SimpleHTTPRequestHandler.translate_path(self, path)
+        return os.path.join(self.root, os.path.relpath(path, os.getcwd()))
+
+    def do_GET(self):
+        if self.path == RELOAD_PATH:
+            return self.send_bytes(str(self.state['build']).encode('ascii'),
+                                   'text/plain')
+        urlpath = self.path.split('?')[0]
+        path = self.translate_path(urlpath)
+        if os.path.isdir(path) and urlpath.endswith('/'):
+            path = os.path.join(path, 'index.html')
+        if path.endswith('.html') and os.path.isfile(path):
+            with open(path, 'rb') as infile:
+                html = infile.read()
+            return self.send_bytes(inject_reload_script(html),
+                                   'text/html; charset=utf-8')
+        return SimpleHTTPRequestHandler.do_GET(self)
+
+    def send_bytes(self, data, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def make_server(outdir, state, host='localhost', port=8000):
+    """Return an HTTP server for the directory ``outdir``. ``state`` is a
+    dict whose ``build`` number the reload script watches."""
+    handler = type('Handler', (ReloadHandler,),
+                   {'root': os.path.abspath(outdir), 'state': state})
+    return ThreadingServer((host, port), handler)
+
+
+def serve(srcdir, outdir, doctreedir=None, confdir=None, host='localhost',
+          port=8000, interval=1.0, parallel=0, exclude=('_build', '.*')):
+    """Build the site, serve it, and rebuild it whenever a file under
+    ``srcdir`` changes, until interrupted."""
+    if doctreedir is None:
+        doctreedir = os.path.join(outdir, '.doctrees')
+    exclude = tuple(exclude)
+    # Don't watch the output, if it is inside the source directory.
+    for path in (outdir, doctreedir):
+        relpath = os.path.relpath(os.path.abspath(path),
+                                  os.path.abspath(srcdir))
+        if not relpath.startswith(os.pardir):
+            exclude += (relpath.split(os.sep)[0],)
+
+    state = {'build': 0}
+    files = snapshot(srcdir, exclude)
+    build(srcdir, outdir, doctreedir, confdir, parallel)
+    server = make_server(outdir, state, host, port)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    sys.stderr.write('Serving %s at http://%s:%d/\n' % (outdir, host, port))
+    try:
+        while True:
+            time.sleep(interval)
+            current = snapshot(srcdir, exclude)
+            changed = changed_files(files, current)
+            if not changed:
+                continue
+            files = current
+            sys.stderr.write('Changed: %s\n' % ', '.join(
+                os.path.relpath(path, srcdir) for path in changed))
+            started = time.time()
+            if build(srcdir, outdir, doctreedir, confdir, parallel):
+                state['build'] += 1
+            sys.stderr.write('Rebuilt in %.1fs\n' % (time.time() - started))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,102 @@
+# Copyright 2015 Vince Veselosky and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module contains the sitemap writer.
+
+Like the feed writers, the ``SitemapWriter`` streams one URL at a time to an
+open file, so a sitemap never has to fit in memory. The sitemaps protocol
+allows at most 50,000 URLs per file; larger sites are split into shards
+listed by a sitemap index, which is written with the same class.
+
+This module must not import Sphinx.
+"""
+import codecs
+import gzip
+import os.path
+from contextlib import contextmanager
+
+from .feeds import escape, format_iso8601
+
+SITEMAP_NAMESPACE = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+
+# The most URLs the protocol allows in one sitemap file.
+MAX_URLS = 50000
+
+
+class SitemapWriter(object):
+    """Writes a sitemap to a stream, one URL at a time.
+
+    Call ``start`` once, then ``write_url`` for each URL, then ``end``. With
+    ``index`` true, the document is a sitemap index and each URL is that of
+    a sitemap.
+    """
+
+    def __init__(self, stream, index=False):
+        self.stream = stream
+        self.index = index
+        self.root, self.item = (('sitemapindex', 'sitemap') if index else
+                                ('urlset', 'url'))
+
+    def start(self):
+        """Write the sitemap header."""
+        self.stream.write(u'<?xml version="1.0" encoding="utf-8"?>\n')
+        self.stream.write(u'<%s xmlns="%s">\n' %
+                          (self.root, SITEMAP_NAMESPACE))
+
+    def write_url(self, loc, lastmod=None):
+        """Write one ``url`` (or ``sitemap``) element."""
+        write = self.stream.write
+        write(u'  <%s>\n' % self.item)
+        write(u'    <loc>%s</loc>\n' % escape(loc))
+        if lastmod is not None:
+            write(u'    <lastmod>%s</lastmod>\n' % format_iso8601(lastmod))
+        write(u'  </%s>\n' % self.item)
+
+    def end(self):
+        """Write the end of the sitemap."""
+        self.stream.write(u'</%s>\n' % self.root)
+
+
+def shard_filename(filename, number):
+    """Return the file name of shard ``number`` of the sitemap
+    ``filename``, for instance ``sitemap-1.xml`` for ``sitemap.xml``."""
+    root, ext = os.path.splitext(filename)
+    if ext == '.gz':
+        root, inner = os.path.splitext(root)
+        ext = inner + ext
+    return '%s-%d%s' % (root, number, ext)
+
+
+@contextmanager
+def open_sitemap(path, compress=False):
+    """Open ``path`` for writing unicode text, compressed with gzip if
+    ``compress`` is true.
+
+    The gzip header carries no timestamp, so the same sitemap always
+    compresses to the same bytes.
+    """
+    outfile = open(path, 'wb')
+    try:
+        if compress:
+            zipfile = gzip.GzipFile(os.path.basename(path), 'wb', 9, outfile,
+                                    mtime=0)
+            try:
+                yield codecs.getwriter('utf-8')(zipfile)
+            finally:
+                zipfile.close()
+        else:
+            yield codecs.getwriter('utf-8')(outfile)
+    finally:
+        outfile.close()
@@ -0,0 +1,135 @@
+/*
+ * blogsearch.js
+ * ~~~~~~~~~~~~~
+ *
+ * Client for Chephren's sharded blog search index. The index is split into
+ * JSON shards by the first characters of each term, and only the shards for
+ * the terms of a query are fetched, once each.
+ *
+ * Usage:
+ *
+ *     BlogSearch.init(DOCUMENTATION_OPTIONS.URL_ROOT + '_search/',
+ *                     DOCUMENTATION_OPTIONS.URL_ROOT);
+ *     BlogSearch.search('sphinx themes', function (results) {
+ *       // results is a list of {docname, title, url}
+ *     });
+ *
+ * The second argument is the site root relative to the page, which result
+ * URLs are made relative to. It defaults to DOCUMENTATION_OPTIONS.URL_ROOT.
+ *
+ * Keep tokenize and shardName in step with chephren/search.py: a term is a
+ * run of two or more letters or digits, in any script, lowercased, that is
+ * not a stopword. Everything else, including punctuation and "_", separates
+ * terms.
+ */
+
+var BlogSearch = {
+  root: '_search/',
+  urlRoot: '',
+  prefixLength: 2,
+  wordPattern: /[\p{L}\p{N}]{2,}/gu,
+  shards: {},
+  stopwords: ('an and are as at be but by for from has have he her his if ' +
+              'in into is it its no not of on or she so such than that the ' +
+              'their them then there these they this to was we were which ' +
+              'will with you your').split(' '),
+
+  init: function (root, urlRoot) {
+    this.root = root;
+    if (urlRoot === undefined &&
+        typeof DOCUMENTATION_OPTIONS !== 'undefined') {
+      urlRoot = DOCUMENTATION_OPTIONS.URL_ROOT;
+    }
+    this.urlRoot = urlRoot || '';
+    this.shards = {};
+  },
+
+  tokenize: function (text) {
+    var words = text.toLowerCase().match(this.wordPattern) || [];
+    var terms = [];
+    for (var i = 0; i < words.length; i++) {
+      var word = words[i];
+      if (this.stopwords.indexOf(word) < 0 && terms.indexOf(word) < 0) {
+        terms.push(word);
+      }
+    }
+    return terms;
+  },
+
+  shardName: function (key) {
+    var bytes = unescape(encodeURIComponent(key));
+    var name = '';
+    for (var i = 0; i < bytes.length; i++) {
+      var hex = bytes.charCodeAt(i).toString(16);
+      name += hex.length < 2 ? '0' + hex : hex;
+    }
+    return name + '.json';
+  },
+
+  loadShard: function (key, callback) {
+    var self = this;
+    if (key in this.shards) {
+      callback(this.shards[key]);
+      return;
+    }
+    var request = new XMLHttpRequest();
+    request.open('GET', this.root + this.shardName(key));
+    request.onload = function () {
+      var shard = {terms: {}, docs: {}};
+      if (request.status === 200) {
+        shard = JSON.parse(request.responseText);
+      }
+      self.shards[key] = shard;
+      callback(shard);
+    };
+    request.onerror = function () {
+      callback({terms: {}, docs: {}});
+    };
+    request.send();
+  },
+
+  /* Find the articles containing every term of the query. */
+  search: function (query, callback) {
+    var self = this;
+    var terms = this.tokenize(query);
+    var pending = terms.length;
+    var found = [];
+    if (!pending) {
+      callback([]);
+      return;
+    }
+    terms.forEach(function (term, n) {
+      self.loadShard(term.substr(0, self.prefixLength), function (shard) {
+        found[n] = {docnames: shard.terms[term] || [], docs: shard.docs};
+        if (--pending === 0) {
+          callback(self.intersect(found));
+        }
+      });
+    });
+  },
+
+  intersect: function (found) {
+    found.sort(function (a, b) {
+      return a.docnames.length - b.docnames.length;
+    });
+    var results = [];
+    var first = found[0];
+    for (var i = 0; i < first.docnames.length; i++) {
+      var docname = first.docnames[i];
+      var everywhere = true;
+      for (var j = 1; j < found.length; j++) {
+        if (found[j].docnames.indexOf(docname) < 0) {
+          everywhere = false;
+          break;
+        }
+      }
+      if (everywhere) {
+        var doc = first.docs[docname];
+        // Shards hold URLs relative to the site root.
+        results.push({docname: docname, title: doc[0],
+                      url: this.urlRoot + doc[1]});
+      }
+    }
+    return results;
+  }
+};
@@ -0,0 +1,124 @@
+# Copyright 2015 Vince Veselosky and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+This module contains an on-disk store for rendered content.
+
+Rendered article bodies are large, and only a few of them are needed by any
+one build (the ones that go into feeds). Keeping them in the Sphinx
+environment means pickling and unpickling all of them on every build. The
+``ContentStore`` keeps one file per document instead, along with the hash
+of its content, so that unchanged content is never rewritten and callers
+can tell whether content changed without reading it.
+
+Because each document has its own files, any process may write to the
+store, which is how bodies rendered by parallel Sphinx writers reach the
+main process.
+
+This module must not import Sphinx.
+"""
+import errno
+import hashlib
+import io
+import os
+import tempfile
+
+
+def _makedirs(dirname):
+    try:
+        os.makedirs(dirname)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def _read(path):
+    try:
+        with io.open(path, encoding='utf-8') as infile:
+            return infile.read()
+    except IOError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return None
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+def write_atomically(path, content):
+    """Write unicode ``content`` to ``path`` through a temporary file, so
+    that readers never see a partial file."""
+    dirname = os.path.dirname(path)
+    _makedirs(dirname)
+    fd, tmppath = tempfile.mkstemp(dir=dirname)
+    try:
+        with os.fdopen(fd, 'wb') as outfile:
+            outfile.write(content.encode('utf-8'))
+        if os.name == 'nt':
+            _remove(path)
+        os.rename(tmppath, path)
+    except Exception:
+        _remove(tmppath)
+        raise
+
+
+class ContentStore(object):
+    """A store of unicode text by name, kept in a directory.
+
+    Names are Sphinx docnames and may contain slashes.
+    """
+
+    suffix = '.html'
+    key_suffix = '.sha1'
+
+    def __init__(self, root, suffix=None):
+        self.root = root
+        if suffix:
+            self.suffix = suffix
+
+    def key_for(self, content):
+        """Return the key (content hash) of ``content``."""
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+    def path_for(self, name, suffix=None):
+        """Return the file path of the content stored under ``name``."""
+        return os.path.join(self.root, *name.split('/')) + \
+            (suffix or self.suffix)
+
+    def put(self, name, content):
+        """Store ``content`` under ``name`` and return its key. Content
+        that is already stored is not written again."""
+        key = self.key_for(content)
+        if self.key(name) != key:
+            write_atomically(self.path_for(name), content)
+            write_atomically(self.path_for(name, self.key_suffix), key)
+        return key
+
+    def key(self, name):
+        """Return the key of the content stored under ``name``, or None."""
+        return _read(self.path_for(name, self.key_suffix))
+
+    def get(self, name):
+        """Return the content stored under ``name``, or None if missing."""
+        return _read(self.path_for(name))
+
+    def remove(self, name):
+        """Remove the content stored under ``name``, if any."""
+        _remove(self.path_for(name, self.key_suffix))
+        _remove(self.path_for(name))
@@ -16,6 +16,7 @@
 This module contains the Sphinx extension.
 """
 
+from . import __version__, images
 from .domain import BlogDomain
 
 
@@ -25,10 +26,44 @@ def setup(app):
     app.add_config_value('project_description', '', '')
     app.add_config_value('feed_author', '', '')
     app.add_config_value('feed_filename', 'recent.atom', 'html')
-    app.add_config_value('timezone', 'UTC', '')
+    app.add_config_value('feed_formats', ['atom'], 'html')
+    app.add_config_value('feed_page_size', 25, 'html')
+    app.add_config_value('feed_archive_filename', 'archive/feed-%d.atom',
+                         'html')
+    app.add_config_value('category_feed_filename', '', 'html')
+    app.add_config_value('tag_feed_filename', '', 'html')
+    app.add_config_value('author_feed_filename', '', 'html')
+    app.add_config_value('sitemap_filename', '', 'html')
+    app.add_config_value('sitemap_shard_size', 50000, 'html')
+    app.add_config_value('sitemap_gzip', False, 'html')
+    app.add_config_value('search_index_dir', '', 'env')
+    app.add_config_value('precompress', [], 'html')
+    app.add_config_value('precompress_extensions',
+                         ['.html', '.atom', '.rss', '.json', '.xml'],
+                         'html')
+    app.add_config_value('home_page', '', 'html')
+    app.add_config_value('home_page_size', 10, 'html')
+    app.add_config_value('home_page_archive', 'page/%d/index', 'html')
+    app.add_config_value('home_page_template', 'page.html', 'html')
+    app.add_config_value('author_page', '', 'html')
+    app.add_config_value('author_page_template', 'page.html', 'html')
+    app.add_config_value('related_posts', 5, 'env')
+    app.add_config_value('featured_image_dir', '_images/featured', 'html')
+    app.add_config_value('featured_image_sizes', dict(images.SIZES), 'html')
+    app.add_config_value('prev_next', 'timeline', 'env')
+    app.add_config_value('timezone', 'UTC', 'env')
+    app.add_config_value('profile_filename', '', '')
+    app.add_config_value('profile_slowest', 10, '')
 
-    app.connect('builder-inited', BlogDomain.on_builder_inited)
+    app.connect('env-updated', BlogDomain.on_env_updated)
     app.connect('html-page-context', BlogDomain.on_html_page_context)
+    app.connect('html-collect-pages', BlogDomain.on_html_collect_pages)
     app.connect('build-finished', BlogDomain.on_build_finished)
     app.connect('missing-reference', BlogDomain.on_missing_reference)
 
+    return {
+        'version': __version__,
+        'parallel_read_safe': True,
+        'parallel_write_safe': True,
+    }
+
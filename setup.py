@@ -29,6 +29,7 @@ setup(
     name="chephren",
     version=__version__,
     packages=find_packages(),
+    package_data={'chephren': ['static/*.js']},
     author="Vince Veselosky",
     author_email="vince@veselosky.com",
     description="An extension to Sphinx for managing a blog or static website",
@@ -38,11 +39,17 @@ setup(
     # could also include download_url, classifiers, etc.
 
     install_requires=[
-        'werkzeug >= 0.10',
         'python-dateutil',
         'pytz',
         'sphinx >= 1.3.0',
     ],
+    extras_require={
+        'brotli': ['brotli'],
+        'images': ['Pillow'],
+    },
+    entry_points={
+        'console_scripts': ['chephren = chephren.cli:main'],
+    },
     tests_require=[
         'pytest',
     ],
@@ -0,0 +1,106 @@
+import io
+import json
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+from chephren import catalog, cli
+from chephren.catalog import parse_iso8601, parse_source, scan
+
+SOURCE = u'''\
+A Post
+======
+
+.. blog:post:: 2015-02-01T18:00:00-0500
+   :Category: Technology, Science
+   :tags: test,
+      another test
+   :noindex:
+
+   The description.
+
+Body text.
+'''
+
+
+def test_parse_iso8601():
+    assert parse_iso8601('2015-03-17') == datetime(2015, 3, 17)
+    assert parse_iso8601(' 2015-03-17 09:30 ') == \
+        datetime(2015, 3, 17, 9, 30)
+    assert parse_iso8601('2015-03-17T09:30:05.25') == \
+        datetime(2015, 3, 17, 9, 30, 5, 250000)
+    utc = parse_iso8601('2015-03-17T09:30:00Z')
+    assert utc.utcoffset() == timedelta(0)
+    east = parse_iso8601('2015-03-17T09:30:00+0530')
+    assert east.utcoffset() == timedelta(hours=5, minutes=30)
+    west = parse_iso8601('2015-03-17T09:30:00-05:00')
+    assert west.utcoffset() == timedelta(hours=-5)
+    assert west == utc + timedelta(hours=5)
+    # Anything else is left to the free-form parser.
+    assert parse_iso8601('March 17, 2015') is None
+    assert parse_iso8601('2015-03-17T09') is None
+
+
+def test_parse_source():
+    meta = parse_source(SOURCE)
+    assert meta['title'] == u'A Post'
+    assert meta['date'] == u'2015-02-01T18:00:00-0500'
+    assert meta['category'] == [u'Technology', u'Science']
+    assert meta['tags'] == [u'test', u'another test']
+    assert meta['noindex'] is True
+    assert meta['draft'] is False
+    assert meta['author'] == ''
+    assert meta['description'] == u'The description.'
+
+    assert parse_source(u'Just a page\n===========\n') is None
+    with pytest.raises(ValueError):
+        parse_source(u'.. blogpost::\n   :image:\n')
+
+
+def _write(path, text):
+    with io.open(path, 'w', encoding='utf-8') as outfile:
+        outfile.write(text)
+
+
+def test_scan_cache(tmpdir, monkeypatch):
+    srcdir = str(tmpdir.mkdir('src'))
+    cache = str(tmpdir.join('catalog.json'))
+    _write(os.path.join(srcdir, 'a.rst'), SOURCE)
+    _write(os.path.join(srcdir, 'b.rst'), u'.. post:: 2015-01-01\n')
+    _write(os.path.join(srcdir, 'c.rst'), u'Not a post.\n')
+    os.mkdir(os.path.join(srcdir, '_build'))
+    _write(os.path.join(srcdir, '_build', 'd.rst'), u'.. post::\n')
+
+    records = list(scan(srcdir, cache=cache))
+    assert [r['docname'] for r in records] == ['a', 'b']
+    assert records[0]['datetime'] == '2015-02-01T18:00:00-05:00'
+    assert os.path.exists(cache)
+
+    # Unchanged files are not read again.
+    monkeypatch.setattr(catalog, 'parse_source', None)
+    assert list(scan(srcdir, cache=cache)) == records
+    monkeypatch.undo()
+
+    os.remove(os.path.join(srcdir, 'b.rst'))
+    errors = []
+    _write(os.path.join(srcdir, 'c.rst'), u'.. post::\n   :bogus:\n')
+    assert [r['docname'] for r in scan(srcdir, cache=cache,
+                                       errors=errors)] == ['a']
+    assert [path for path, error in errors] == ['c.rst']
+
+
+def test_cli_sort_by_date(tmpdir, capsys):
+    srcdir = str(tmpdir)
+    _write(os.path.join(srcdir, 'a.rst'),
+           u'.. post:: 2015-01-01T10:00:00-05:00\n')
+    _write(os.path.join(srcdir, 'b.rst'),
+           u'.. post:: 2015-01-01T12:00:00+00:00\n')
+    _write(os.path.join(srcdir, 'c.rst'), u'.. post:: 2015-01-01T13:00\n')
+    _write(os.path.join(srcdir, 'd.rst'), u'.. post::\n')
+    assert cli.main(['catalog', srcdir, '--cache', '',
+                     '--sort', 'date']) == 0
+    lines = capsys.readouterr()[0].splitlines()
+    # a is at 15:00 UTC, and c without an offset counts as UTC.
+    assert [json.loads(line)['docname'] for line in lines] == \
+        ['b', 'c', 'a', 'd']
@@ -0,0 +1,45 @@
+import gzip
+import os
+
+from chephren.compress import find_files, precompress, remove_siblings
+
+
+def test_precompress(tmpdir):
+    root = str(tmpdir)
+    tmpdir.join('index.html').write('<p>Hello</p>')
+    tmpdir.mkdir('archive').join('feed-1.atom').write('<feed />')
+    tmpdir.join('style.css').write('p {}')
+    paths = list(find_files(root, ['.html', '.atom']))
+    assert paths == ['index.html', 'archive/feed-1.atom']
+
+    manifest = {}
+    assert precompress(root, paths, ['gzip'], manifest, processes=2) == 2
+    with gzip.open(os.path.join(root, 'index.html.gz')) as infile:
+        assert infile.read() == b'<p>Hello</p>'
+    assert not os.path.exists(os.path.join(root, 'style.css.gz'))
+
+    tmpdir.join('index.html').write('<p>Changed</p>')
+    assert precompress(root, paths, ['gzip'], manifest, processes=2) == 1
+
+
+def test_prune(tmpdir):
+    root = str(tmpdir)
+    tmpdir.join('a.html').write('<p>A</p>')
+    tmpdir.join('b.html').write('<p>B</p>')
+    manifest = {}
+    precompress(root, ['a.html', 'b.html'], ['gzip'], manifest, processes=1)
+    tmpdir.join('b.html.br').write('stale')
+    tmpdir.join('b.html').remove()
+    assert precompress(root, list(find_files(root, ['.html'])), ['gzip'],
+                       manifest, processes=1) == 0
+    assert sorted(manifest) == ['a.html']
+    assert sorted(os.listdir(root)) == ['a.html', 'a.html.gz']
+
+
+def test_remove_siblings(tmpdir):
+    root = str(tmpdir)
+    tmpdir.join('a.html').write('<p>A</p>')
+    tmpdir.join('a.html.gz').write('gzip')
+    tmpdir.join('a.html.br').write('br')
+    assert remove_siblings(root, ['a.html', 'b.html'], ['br']) == 1
+    assert sorted(os.listdir(root)) == ['a.html', 'a.html.gz']
@@ -0,0 +1,569 @@
+import calendar
+import os
+import tempfile
+
+import pytest
+
+pytest.importorskip('sphinx')
+
+from chephren.domain import (  # noqa: E402
+    Article, BlogDomain, ChronologicalIndex, TagIndex, intersect_buckets,
+    newest_first, union_buckets, unique_slugs)
+
+
+class Config(object):
+    timezone = 'UTC'
+    profile_filename = ''
+    profile_slowest = 10
+    related_posts = 5
+    prev_next = 'timeline'
+    base_url = 'http://example.com'
+    featured_image_dir = '_images/featured'
+    featured_image_sizes = {'thumbnail': (10, 10)}
+    project = 'Blog'
+    home_page = 'index'
+    home_page_size = 2
+    home_page_archive = 'page/%d/index'
+    home_page_template = 'page.html'
+    author_page = 'author/%s'
+    author_page_template = 'page.html'
+    sitemap_filename = 'sitemap.xml'
+    sitemap_gzip = False
+    sitemap_shard_size = 2
+    copyright = ''
+    feed_author = ''
+    feed_formats = ['atom']
+    feed_filename = 'recent.atom'
+    feed_page_size = 2
+    feed_archive_filename = 'archive/feed-%d.atom'
+    category_feed_filename = ''
+    tag_feed_filename = 'tag/%s.atom'
+    author_feed_filename = ''
+    precompress = []
+    precompress_extensions = ['.html', '.atom']
+
+
+class Builder(object):
+    name = 'html'
+    out_suffix = '.html'
+
+    def __init__(self):
+        self.outdir = tempfile.mkdtemp()
+
+    def get_relative_uri(self, fromname, toname):
+        return toname + self.out_suffix
+
+    def get_outfilename(self, pagename):
+        return os.path.join(self.outdir, pagename + self.out_suffix)
+
+
+class App(object):
+    """Just enough of a Sphinx application to write pages."""
+
+    parallel = 0
+
+    def __init__(self, domain=None, **config):
+        self.config = Config()
+        self.config.__dict__.update(config)
+        self.builder = Builder()
+        self.srcdir = tempfile.mkdtemp()
+        self.warnings = []
+        if domain is not None:
+            self.env = domain.env
+            self.env.domains = {'blog': domain}
+
+    def debug(self, message):
+        pass
+
+    def warn(self, message):
+        self.warnings.append(message)
+
+    def write(self, pages):
+        """Render pages from html-collect-pages by touching their files,
+        and return their names."""
+        names = []
+        for pagename, context, templatename in pages:
+            outfile = self.builder.get_outfilename(pagename)
+            if not os.path.isdir(os.path.dirname(outfile)):
+                os.makedirs(os.path.dirname(outfile))
+            open(outfile, 'w').close()
+            names.append(pagename)
+        return names
+
+
+class Env(object):
+    """Just enough of a Sphinx environment for the blog domain.
+
+    ``app`` is None, as it is when Sphinx emits env-updated.
+    """
+
+    def __init__(self):
+        self.domaindata = {}
+        self.metadata = {}
+        self.config = Config()
+        self.doctreedir = tempfile.mkdtemp()
+        self.app = None
+
+
+@pytest.fixture
+def domain():
+    return BlogDomain(Env())
+
+
+def article(docname, date, categories=(), tags=(), authors=(), image=None):
+    return Article(docname, docname.title(), docname, date, None, u'',
+                   tuple(categories), tuple(tags), tuple(authors), image)
+
+
+def epoch(*args):
+    return calendar.timegm(args + (0,) * (6 - len(args)))
+
+
+def docnames(domain, ids):
+    return [domain.data['articles'][id].docname for id in ids]
+
+
+def test_publish_scheduled(domain):
+    domain.add_article(article('old', 1000))
+    domain.schedule(article('soon', 2000))
+    domain.schedule(article('later', 3000))
+    # Rescheduled: the first heap entry is stale and must be skipped.
+    domain.schedule(article('moved', 2500))
+    domain.clear_doc('moved')
+    domain.schedule(article('moved', 3500))
+
+    assert domain.publish_scheduled(now=1500) == []
+    assert domain.publish_scheduled(now=3000) == ['soon', 'later']
+    assert sorted(domain.data['docids']) == ['later', 'old', 'soon']
+    assert list(domain.data['pending']) == ['moved']
+    assert domain.publish_scheduled(now=4000) == ['moved']
+    assert docnames(domain, [e[-1] for e in domain.data['timeline']]) == \
+        ['old', 'soon', 'later', 'moved']
+
+
+def test_ties_keep_docname_order(domain):
+    for docname in ('b', 'c', 'a'):
+        domain.add_article(article(docname, 1000, categories=['x']))
+    # Read again, so 'b' gets a newer id than the others.
+    domain.clear_doc('b')
+    domain.add_article(article('b', 1000, categories=['x']))
+    for dataname, key in (('timeline', None), ('by_category', 'x')):
+        bucket = domain.get_bucket(dataname, key)
+        assert [e[1] for e in bucket] == ['a', 'b', 'c']
+    assert domain.get_neighbors('b', 'timeline') == \
+        (domain.data['docids']['a'], domain.data['docids']['c'])
+
+    other = BlogDomain(Env())
+    other.merge_domaindata(['b', 'c'], domain.data)
+    other.merge_domaindata(['a'], domain.data)
+    assert [e[1] for e in other.data['timeline']] == ['a', 'b', 'c']
+
+
+def test_newest_first_ties():
+    bucket = [(1, 'a', 5), (2, 'a', 3), (2, 'b', 1), (2, 'c', 4), (3, 'a', 2)]
+    assert newest_first(bucket) == [2, 3, 1, 4, 5]
+    # A limit cuts a run of ties after its first docnames.
+    assert newest_first(bucket, 2) == [2, 3]
+    assert newest_first(bucket, 0) == []
+    assert newest_first([], 3) == []
+
+
+def test_feed_item_uses_rendered_title(domain):
+    domain.add_article(article('post', 1000))
+    id = domain.data['docids']['post']
+    assert domain.make_feed_item(App(), id)['title'] == u'Post'
+    domain.title_store.put('post', u'&#8220;Post&#8221;')
+    item = domain.make_feed_item(App(), id)
+    assert item['title'] == u'&#8220;Post&#8221;'
+    assert item['url'] == 'http://example.com/post.html'
+    domain.clear_doc('post')
+    assert domain.title_store.get('post') is None
+
+
+def test_clear_doc(domain):
+    domain.add_article(article('a', 1000, categories=['x'], tags=['t']))
+    domain.add_article(article('b', 2000, categories=['x', 'y']))
+    domain.clear_doc('b')
+    domain.clear_doc('missing')
+    assert list(domain.data['docids']) == ['a']
+    assert [a.docname for a in domain.data['articles'].values()] == ['a']
+    assert [e[1] for e in domain.data['by_category']['x']] == ['a']
+    # Buckets left empty are dropped.
+    assert 'y' not in domain.data['by_category']
+    domain.clear_doc('a')
+    assert domain.data['timeline'] == []
+    assert domain.data['by_category'] == {}
+    assert domain.data['by_tag'] == {}
+
+
+def test_merge_domaindata(domain):
+    domain.add_article(article('a', 1000, tags=['t']))
+    other = BlogDomain(Env())
+    other.add_article(article('b', 3000, tags=['t']))
+    other.add_article(article('c', 2000, tags=['t']))
+    other.schedule(article('d', 4000))
+    domain.merge_domaindata(['b', 'c', 'd'], other.data)
+    assert sorted(domain.data['docids']) == ['a', 'b', 'c']
+    assert list(domain.data['pending']) == ['d']
+    assert [e[1] for e in domain.data['by_tag']['t']] == ['a', 'c', 'b']
+    # Ids are our own, handed out in docname order.
+    assert [domain.data['docids'][d] for d in 'abc'] == [0, 1, 2]
+
+
+def test_as_datetime_memoized(domain):
+    first = domain.as_datetime('2015-03-17T09:30:00-05:00')
+    assert first.hour == 14 and first.utcoffset().total_seconds() == 0
+    assert domain.as_datetime('2015-03-17T09:30:00-05:00') is first
+    assert domain.as_datetime('March 17, 2015').day == 17
+    info = domain.date_cache_info()
+    assert (info['hits'], info['misses'], info['size']) == (1, 2, 2)
+
+
+def test_intersect_and_union_buckets():
+    a = [(1, 'a', 0), (2, 'b', 1), (3, 'c', 2), (4, 'd', 3)]
+    b = [(2, 'b', 1), (4, 'd', 3), (5, 'e', 4)]
+    c = [(4, 'd', 3)]
+    assert intersect_buckets([a, b]) == [(2, 'b', 1), (4, 'd', 3)]
+    assert intersect_buckets([a, b, c]) == c
+    assert intersect_buckets([a, []]) == []
+    assert intersect_buckets([]) == []
+    assert union_buckets([b, c]) == b
+    assert union_buckets([c, a]) == a
+    assert union_buckets([]) == []
+
+
+def test_tag_query(domain):
+    domain.add_article(article('a', 1000, tags=['python']))
+    domain.add_article(article('b', 2000, tags=['python', 'sphinx']))
+    domain.add_article(article('c', 3000, tags=['python', 'sphinx', 'web']))
+    domain.add_article(article('d', 4000, tags=['web']))
+    index = TagIndex(domain)
+
+    def query(**kwargs):
+        return [entry.docname for entry in index.query(**kwargs)]
+
+    assert query(all_tags=['python', 'sphinx']) == ['c', 'b']
+    assert query(all_tags=['python'], limit=1) == ['c']
+    assert query(any_tags=['sphinx', 'web']) == ['d', 'c', 'b']
+    assert query(all_tags=['python'], any_tags=['web', 'nope']) == ['c']
+    assert query(all_tags=['python', 'nope']) == []
+    assert query(any_tags=['nope']) == []
+
+
+def test_calendar(domain):
+    domain.add_article(article('a', epoch(2014, 12, 31, 23)))
+    domain.add_article(article('b', epoch(2015, 3, 17, 9)))
+    domain.add_article(article('c', epoch(2015, 3, 17, 18)))
+    domain.add_article(article('d', epoch(2015, 5, 1)))
+    index = ChronologicalIndex(domain)
+    assert sorted(index.get_calendar()) == ['2014', '2015']
+    year = index.get_calendar('2015')
+    assert year['count'] == 3
+    assert year['newest'][1] == 'd' and year['oldest'][1] == 'b'
+    assert sorted(year['months']) == ['2015-03', '2015-05']
+    day = index.get_calendar('2015-03-17')
+    assert (day['count'], day['newest'][1], day['oldest'][1]) == (2, 'c', 'b')
+    assert index.count('2015-03') == 2
+    assert index.count('2015-04') == 0
+    assert index.get_calendar('2016-01-01') is None
+
+    domain.clear_doc('c')
+    assert index.get_calendar('2015-03-17')['newest'][1] == 'b'
+    assert index.count('2015') == 2
+    domain.clear_doc('a')
+    assert index.get_calendar('2014') is None
+    assert sorted(index.get_calendar()) == ['2015']
+
+
+def test_insert_and_remove_entries(domain):
+    for entry in [(3, 'c', 0), (1, 'a', 1), (2, 'b', 2)]:
+        domain.insert_entry('by_tag', 't', entry)
+    assert domain.get_bucket('by_tag', 't') == \
+        [(1, 'a', 1), (2, 'b', 2), (3, 'c', 0)]
+    assert ('by_tag', 't', (1, 'a', 1)) in domain.data['related_dirty']
+    domain.remove_from_bucket('by_tag', 't', (2, 'b', 2))
+    # Removing an entry that is not there changes nothing.
+    domain.remove_from_bucket('by_tag', 't', (2, 'b', 9))
+    domain.remove_from_bucket('by_tag', 'missing', (2, 'b', 2))
+    assert domain.get_bucket('by_tag', 't') == [(1, 'a', 1), (3, 'c', 0)]
+    domain.remove_from_bucket('by_tag', 't', (1, 'a', 1))
+    domain.remove_from_bucket('by_tag', 't', (3, 'c', 0))
+    assert domain.get_bucket('by_tag', 't') is None
+
+
+def test_home_pages(domain):
+    for i, docname in enumerate('abcde'):
+        domain.add_article(article(docname, 1000 * (i + 1)))
+    index = ChronologicalIndex(domain)
+    assert index.count_pages(2) == 2
+    assert index.count_pages(5) == 1
+    assert index.count_pages(6) == 0
+    assert [e[1] for e in index.get_page(1, 2)] == ['b', 'a']
+    assert [e[1] for e in index.get_page(2, 2)] == ['d', 'c']
+
+    app = App()
+    pages = list(domain.collect_home_pages(app))
+    assert [p[0] for p in pages] == ['index', 'page/2/index', 'page/1/index']
+    home = pages[0][1]
+    assert [e.docname for e in home['entries']] == ['e', 'd']
+    assert home['older_page'] == 'page/2/index.html'
+    assert home['newer_page'] is None
+    assert pages[2][1]['title'] == 'Blog, page 1'
+    app.write(pages)
+
+    # Only the home page is written again, until a page changes.
+    domain.changed_docs = set()
+    assert app.write(domain.collect_home_pages(app)) == ['index']
+    domain.changed_docs = set(['c'])
+    assert app.write(domain.collect_home_pages(app)) == \
+        ['index', 'page/2/index']
+    domain.changed_docs = set()
+    app.builder.config_hash = 'changed html_title'
+    assert app.write(domain.collect_home_pages(app)) == \
+        ['index', 'page/2/index', 'page/1/index']
+
+    domain.clear_doc('e')
+    domain.clear_doc('d')
+    assert app.write(domain.collect_home_pages(app)) == \
+        ['index', 'page/1/index']
+    assert not os.path.exists(app.builder.get_outfilename('page/2/index'))
+
+
+def test_neighbors(domain):
+    domain.add_article(article('a', 1000, categories=['x']))
+    domain.add_article(article('b', 2000, categories=['y']))
+    domain.add_article(article('c', 3000, categories=['x']))
+    ids = domain.data['docids']
+
+    assert domain.get_neighbors('b', 'timeline') == (ids['a'], ids['c'])
+    assert domain.get_neighbors('a', 'timeline') == (None, ids['b'])
+    assert domain.get_neighbors('c', 'category') == (ids['a'], None)
+    assert domain.get_neighbors('b', 'category') == (None, None)
+    assert domain.get_neighbors('missing', 'timeline') == (None, None)
+
+
+def test_update_navigation(domain):
+    for i, docname in enumerate('abcd'):
+        domain.add_article(article(docname, 1000 * (i + 1),
+                                   categories=['x' if i % 2 else 'y']))
+    domain.update_navigation(App())
+
+    # A new article in the middle changes the links of its neighbors.
+    domain.changed_docs = set(['bc'])
+    domain.add_article(article('bc', 2500, categories=['y']))
+    assert domain.update_navigation(App()) == ['b', 'c']
+    # Removing it again changes them back.
+    domain.clear_doc('bc')
+    assert domain.update_navigation(App()) == ['b', 'c']
+
+    domain.changed_docs = set(['e'])
+    domain.add_article(article('e', 5000, categories=['y']))
+    assert domain.update_navigation(App(prev_next='category')) == ['c', 'd']
+    domain.clear_doc('e')
+    assert domain.update_navigation(App(prev_next='')) == []
+    assert domain.data['nav_dirty'] == set()
+
+
+def test_author_pages(domain):
+    domain.add_article(article('a', 1000, authors=['Ann Lee']))
+    domain.add_article(article('b', 2000, authors=['Ann Lee', 'Bo']))
+    app = App()
+    pages = list(domain.collect_author_pages(app))
+    assert [p[0] for p in pages] == ['author/ann-lee', 'author/bo']
+    context = pages[0][1]
+    assert context['author'] == 'Ann Lee'
+    assert context['title'] == 'Blog: Ann Lee'
+    assert [e.docname for e in context['entries']] == ['b', 'a']
+    app.write(pages)
+
+    domain.changed_docs = set()
+    assert app.write(domain.collect_author_pages(app)) == []
+    domain.changed_docs = set(['c'])
+    domain.add_article(article('c', 3000, authors=['Bo']))
+    assert app.write(domain.collect_author_pages(app)) == ['author/bo']
+    domain.changed_docs = set()
+    app.builder.config_hash = 'changed html_title'
+    assert app.write(domain.collect_author_pages(app)) == \
+        ['author/ann-lee', 'author/bo']
+
+    # Names that clash get their own page, and a warning.
+    domain.changed_docs = set(['d'])
+    domain.add_article(article('d', 4000, authors=['Ann-Lee']))
+    assert app.write(domain.collect_author_pages(app)) == \
+        ['author/ann-lee-2']
+    assert len(app.warnings) == 1
+
+    domain.clear_doc('d')
+    assert app.write(domain.collect_author_pages(app)) == []
+    assert not os.path.exists(app.builder.get_outfilename('author/ann-lee-2'))
+
+
+def test_unique_slugs():
+    assert unique_slugs(['Sphinx Tips', 'Python']) == \
+        {'Sphinx Tips': 'sphinx-tips', 'Python': 'python'}
+    assert unique_slugs(['C++', 'C', 'c', 'C-2']) == \
+        {'C': 'c', 'C++': 'c-3', 'c': 'c-4', 'C-2': 'c-2'}
+
+
+def outputs(app):
+    return sorted(os.listdir(app.builder.outdir))
+
+
+def test_sitemap_shards_pruned(domain):
+    for i, docname in enumerate('abcde'):
+        domain.add_article(article(docname, 1000 * (i + 1)))
+    app = App()
+    domain.write_sitemaps(app)
+    assert outputs(app) == ['sitemap-1.xml', 'sitemap-2.xml',
+                            'sitemap-3.xml', 'sitemap.xml']
+    domain.clear_doc('e')
+    domain.clear_doc('d')
+    domain.write_sitemaps(app)
+    assert outputs(app) == ['sitemap-1.xml', 'sitemap-2.xml', 'sitemap.xml']
+    app.config.sitemap_shard_size = 10
+    domain.write_sitemaps(app)
+    assert outputs(app) == ['sitemap.xml']
+
+
+def test_topic_feeds_pruned(domain):
+    domain.add_article(article('a', 1000, tags=['python', 'web']))
+    domain.add_article(article('b', 2000, tags=['python']))
+    app = App(domain)
+    domain.write_topic_feeds(app)
+    assert outputs(app) == ['tag']
+    assert sorted(os.listdir(os.path.join(app.builder.outdir, 'tag'))) == \
+        ['python.atom', 'web.atom']
+    domain.clear_doc('a')
+    domain.write_topic_feeds(app)
+    assert os.listdir(os.path.join(app.builder.outdir, 'tag')) == \
+        ['python.atom']
+    app.config.tag_feed_filename = ''
+    domain.write_topic_feeds(app)
+    assert os.listdir(os.path.join(app.builder.outdir, 'tag')) == []
+
+
+def test_topic_feed_fragments_released(domain, monkeypatch):
+    domain.add_article(article('a', 1000, tags=['python', 'web']))
+    domain.add_article(article('b', 2000, tags=['python']))
+    app = App(domain)
+    held = []
+    write_feed_file = BlogDomain.write_feed_file
+
+    def record(app, filename, items, **kwargs):
+        held.append(sorted(kwargs['fragments']))
+        write_feed_file(app, filename, items, **kwargs)
+
+    monkeypatch.setattr(BlogDomain, 'write_feed_file', staticmethod(record))
+    domain.write_topic_feeds(app)
+    # 'b' is only in the python feed, 'a' is kept for the web feed.
+    assert held == [[], [('atom', 'a')]]
+
+
+def test_topic_feeds_follow_config(domain):
+    domain.add_article(article('a', 1000, tags=['python']))
+    app = App(domain)
+    feed = os.path.join(app.builder.outdir, 'tag', 'python.atom')
+    domain.write_topic_feeds(app)
+    domain.changed_docs = set()
+    app.config.project = 'Renamed'
+    app.config.copyright = '2015, Ann'
+    domain.write_topic_feeds(app)
+    with open(feed) as infile:
+        content = infile.read()
+    assert 'Renamed: python' in content and '2015, Ann' in content
+
+
+def test_feed_formats_pruned(domain):
+    domain.add_article(article('a', 1000, tags=['python']))
+    app = App(domain, feed_formats=['atom', 'rss', 'json'])
+    domain.write_feeds(app)
+    domain.write_topic_feeds(app)
+    tagdir = os.path.join(app.builder.outdir, 'tag')
+    assert outputs(app) == ['recent.atom', 'recent.json', 'recent.rss',
+                            'tag']
+    assert sorted(os.listdir(tagdir)) == \
+        ['python.atom', 'python.json', 'python.rss']
+    app.config.feed_formats = ['atom', 'json']
+    domain.write_feeds(app)
+    domain.write_topic_feeds(app)
+    assert outputs(app) == ['recent.atom', 'recent.json', 'tag']
+    assert sorted(os.listdir(tagdir)) == ['python.atom', 'python.json']
+
+
+def test_feed_archives_pruned(domain):
+    for i, docname in enumerate('abcde'):
+        domain.add_article(article(docname, 1000 * (i + 1)))
+    app = App(domain)
+    archive = os.path.join(app.builder.outdir, 'archive')
+    domain.write_feeds(app)
+    assert sorted(os.listdir(archive)) == ['feed-1.atom', 'feed-2.atom']
+    domain.clear_doc('e')
+    domain.clear_doc('d')
+    domain.write_feeds(app)
+    assert os.listdir(archive) == ['feed-1.atom']
+    app.config.feed_archive_filename = ''
+    domain.write_feeds(app)
+    assert os.listdir(archive) == []
+
+
+def test_feed_archives_follow_config(domain):
+    for i, docname in enumerate('abc'):
+        domain.add_article(article(docname, 1000 * (i + 1)))
+    app = App(domain)
+    domain.write_feeds(app)
+    domain.changed_docs = set()
+    app.config.feed_author = 'Ann Lee'
+    domain.write_feeds(app)
+    with open(os.path.join(app.builder.outdir, 'archive',
+                           'feed-1.atom')) as infile:
+        assert 'Ann Lee' in infile.read()
+
+
+def test_featured_images(domain):
+    Image = pytest.importorskip('PIL.Image')
+    app = App(domain)
+    Image.new('RGB', (40, 20)).save(os.path.join(app.srcdir, 'a.png'))
+    with open(os.path.join(app.srcdir, 'b.svg'), 'w') as outfile:
+        outfile.write('<svg xmlns="http://www.w3.org/2000/svg"/>')
+    domain.changed_docs = set(['a', 'b'])
+    domain.add_article(article('a', 1000, image='a.png'))
+    domain.add_article(article('b', 2000, image='b.svg'))
+    imagedir = domain.image_dir(app)
+
+    # An SVG can't be resized, but it doesn't stop the build.
+    domain.update_images(app)
+    assert len(app.warnings) == 1 and 'b.svg' in app.warnings[0]
+    assert sorted(domain.data['images']['a.png']) == \
+        ['original', 'thumbnail']
+    assert list(domain.data['images']['b.svg']) == ['original']
+    assert len(os.listdir(imagedir)) == 3
+
+    # Nor is it tried again until its post changes.
+    domain.changed_docs = set()
+    domain.update_images(app)
+    assert len(app.warnings) == 1
+
+    # The files of images no post uses any more are removed.
+    domain.clear_doc('a')
+    domain.update_images(app)
+    assert os.listdir(imagedir) == \
+        [domain.data['images']['b.svg']['original'][0]]
+
+
+def test_precompress_reconfigured(domain):
+    app = App(domain, precompress=['gzip'])
+    with open(os.path.join(app.builder.outdir, 'index.html'), 'w') as f:
+        f.write('<p>Hello</p>')
+    domain.precompress_output(app)
+    assert outputs(app) == ['index.html', 'index.html.gz']
+
+    # Without any encodings, the siblings written before are removed.
+    app.config.precompress = []
+    domain.precompress_output(app)
+    assert outputs(app) == ['index.html']
+    domain.precompress_output(app)
+    assert outputs(app) == ['index.html']
+
+    app.config.precompress = ['gzip']
+    domain.precompress_output(app)
+    assert outputs(app) == ['index.html', 'index.html.gz']
@@ -0,0 +1,106 @@
+import io
+import json
+from datetime import datetime
+
+from chephren.feeds import AtomWriter, JSONFeedWriter, RSSWriter
+
+
+def test_atom_writer():
+    when = datetime(2015, 1, 4, 15, 0)
+    out = io.StringIO()
+    feed = AtomWriter(out, u'Site', id=u'http://localhost:8000',
+                      feed_url=u'http://localhost:8000')
+    feed.start(when)
+    feed.write_entry(u'A & B', u'http://localhost:8000/a.html', when,
+                     content=u'<p>Hi</p>', author=u'')
+    feed.end()
+    assert out.getvalue() == u'''\
+<?xml version="1.0" encoding="utf-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom">
+  <title type="text">Site</title>
+  <id>http://localhost:8000</id>
+  <updated>2015-01-04T15:00:00Z</updated>
+  <link href="http://localhost:8000" rel="self" />
+  <generator>Werkzeug</generator>
+  <entry xml:base="http://localhost:8000">
+    <title type="text">A &amp; B</title>
+    <id>http://localhost:8000/a.html</id>
+    <updated>2015-01-04T15:00:00Z</updated>
+    <link href="http://localhost:8000/a.html" />
+    <author>
+      <name></name>
+    </author>
+    <content type="html">&lt;p&gt;Hi&lt;/p&gt;</content>
+  </entry>
+</feed>
+'''
+
+
+def test_rss_writer():
+    when = datetime(2015, 1, 4, 15, 0)
+    out = io.StringIO()
+    feed = RSSWriter(out, u'Site', id=u'http://localhost:8000',
+                     feed_url=u'http://localhost:8000/recent.rss')
+    feed.start(when)
+    feed.write_entry(u'A & B', u'http://localhost:8000/a.html', when,
+                     content=u'<p>Hi</p>', author=u'Ann')
+    feed.end()
+    assert out.getvalue() == u'''\
+<?xml version="1.0" encoding="utf-8"?>
+<rss version="2.0" xmlns:atom="http://www.w3.org/2005/Atom" \
+xmlns:dc="http://purl.org/dc/elements/1.1/">
+  <channel>
+    <title>Site</title>
+    <link>http://localhost:8000</link>
+    <description>Site</description>
+    <atom:link href="http://localhost:8000/recent.rss" rel="self" \
+type="application/rss+xml" />
+    <lastBuildDate>Sun, 04 Jan 2015 15:00:00 +0000</lastBuildDate>
+    <generator>Chephren</generator>
+    <item>
+      <title>A &amp; B</title>
+      <link>http://localhost:8000/a.html</link>
+      <guid isPermaLink="true">http://localhost:8000/a.html</guid>
+      <pubDate>Sun, 04 Jan 2015 15:00:00 +0000</pubDate>
+      <dc:creator>Ann</dc:creator>
+      <description>&lt;p&gt;Hi&lt;/p&gt;</description>
+    </item>
+  </channel>
+</rss>
+'''
+
+
+def test_json_feed_writer():
+    when = datetime(2015, 1, 4, 15, 0)
+    out = io.StringIO()
+    feed = JSONFeedWriter(out, u'Site', id=u'http://localhost:8000',
+                          feed_url=u'http://localhost:8000/recent.json')
+    feed.start(when)
+    for name in (u'a', u'b'):
+        feed.write_entry(name, u'http://localhost:8000/%s.html' % name,
+                         when, content=u'<p>Hi</p>')
+    feed.end()
+    result = json.loads(out.getvalue())
+    assert result['feed_url'] == u'http://localhost:8000/recent.json'
+    assert [item['title'] for item in result['items']] == [u'a', u'b']
+    assert result['items'][0]['date_modified'] == u'2015-01-04T15:00:00Z'
+
+
+def test_image_enclosures():
+    when = datetime(2015, 1, 4, 15, 0)
+    image = {'url': u'http://localhost:8000/a.jpg', 'length': 1234,
+             'type': 'image/jpeg'}
+    for writer, expected in (
+            (AtomWriter, u'<link href="http://localhost:8000/a.jpg" '
+                         u'rel="enclosure" type="image/jpeg" '
+                         u'length="1234" />'),
+            (RSSWriter, u'<enclosure url="http://localhost:8000/a.jpg" '
+                        u'length="1234" type="image/jpeg" />'),
+            (JSONFeedWriter, u'"image": "http://localhost:8000/a.jpg"')):
+        out = io.StringIO()
+        feed = writer(out, u'Site', feed_url=u'http://localhost:8000')
+        feed.start(when)
+        feed.write_entry(u'A', u'http://localhost:8000/a.html', when,
+                         image=image)
+        feed.end()
+        assert expected in out.getvalue()
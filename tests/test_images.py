@@ -0,0 +1,56 @@
+import os
+
+import pytest
+
+from chephren.images import derivative_name, process_images
+
+
+def test_derivative_name():
+    digest = '0123456789abcdef0123'
+    assert derivative_name(digest, 'original', None, '.jpg') == \
+        '0123456789abcdef-original.jpg'
+    assert derivative_name(digest, 'full', (1200, None), '.jpg') == \
+        '0123456789abcdef-full-1200x.jpg'
+    assert derivative_name(digest, 'card', (600, 315), '.png') == \
+        '0123456789abcdef-card-600x315.png'
+
+
+def test_process_images(tmpdir):
+    Image = pytest.importorskip('PIL.Image')
+    source = str(tmpdir.join('a.png'))
+    Image.new('RGB', (1000, 500)).save(source)
+    outdir = str(tmpdir.join('out'))
+    sizes = {'thumbnail': (100, 100), 'full': (400, None)}
+
+    images, written, errors = process_images([source], outdir, sizes,
+                                             processes=1)
+    assert written == 3
+    assert errors == {}
+    derivatives = images[source]
+    assert derivatives['original'][1:3] == (1000, 500)
+    assert derivatives['thumbnail'][1:3] == (100, 50)
+    assert derivatives['full'][1:3] == (400, 200)
+    assert derivatives['full'][4] == 'image/png'
+    assert os.path.exists(os.path.join(outdir, derivatives['full'][0]))
+
+    # Derivatives of unchanged content are not made again.
+    images, written, errors = process_images([source], outdir, sizes,
+                                             processes=1)
+    assert written == 0
+    assert images[source] == derivatives
+
+
+def test_unreadable_image(tmpdir):
+    pytest.importorskip('PIL.Image')
+    source = str(tmpdir.join('a.svg'))
+    tmpdir.join('a.svg').write('<svg xmlns="http://www.w3.org/2000/svg"/>')
+    outdir = str(tmpdir.join('out'))
+
+    images, written, errors = process_images([source], outdir,
+                                             processes=1)
+    assert written == 1
+    assert list(errors) == [source]
+    assert list(images[source]) == ['original']
+    filename, width, height, length, type = images[source]['original']
+    assert (width, height, type) == (None, None, 'image/svg+xml')
+    assert os.listdir(outdir) == [filename]
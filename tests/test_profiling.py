@@ -0,0 +1,64 @@
+import json
+import os
+
+from chephren.profiling import NullProfiler, Profiler
+
+
+def profiler():
+    profiler = Profiler(slowest=2)
+    profiler.record('read', 0.5, 'a')
+    profiler.record('read', 0.25, 'b')
+    profiler.record('read', 1.0, 'c')
+    profiler.record('render', 0.5, 'b')
+    profiler.record('render', 0.25)
+    return profiler
+
+
+def test_record():
+    p = profiler()
+    assert p.seconds == {'read': 1.75, 'render': 0.75}
+    assert p.calls == {'read': 3, 'render': 2}
+    assert p.documents == {'a': {'read': 0.5},
+                           'b': {'read': 0.25, 'render': 0.5},
+                           'c': {'read': 1.0}}
+
+
+def test_report():
+    report = profiler().report()
+    assert report['phases'] == {'read': {'seconds': 1.75, 'calls': 3},
+                                'render': {'seconds': 0.75, 'calls': 2}}
+    # Only the two slowest documents, slowest first, with their phases.
+    assert report['slowest_documents'] == [
+        {'docname': 'c', 'seconds': 1.0, 'phases': {'read': 1.0}},
+        {'docname': 'b', 'seconds': 0.75,
+         'phases': {'read': 0.25, 'render': 0.5}},
+    ]
+
+
+def test_timer():
+    p = Profiler()
+    with p.timer('write', 'a'):
+        pass
+    try:
+        with p.timer('write', 'a'):
+            raise ValueError
+    except ValueError:
+        pass
+    assert p.calls == {'write': 2}
+    assert list(p.documents) == ['a']
+
+    null = NullProfiler()
+    with null.timer('write', 'a'):
+        pass
+    null.record('write', 1.0, 'a')
+    assert not null.enabled
+
+
+def test_write(tmpdir):
+    path = os.path.join(str(tmpdir), 'profile.json')
+    profiler().write(path, date_cache={'hits': 4, 'misses': 1})
+    with open(path) as infile:
+        report = json.load(infile)
+    assert sorted(report) == ['date_cache', 'phases', 'slowest_documents']
+    assert report['date_cache'] == {'hits': 4, 'misses': 1}
+    assert [d['docname'] for d in report['slowest_documents']] == ['c', 'b']
@@ -0,0 +1,42 @@
+from chephren.related import WINDOW, find_related, neighborhood
+
+
+def entries(*docnames):
+    # One article a second, in docname order.
+    return [(i, docname, i) for i, docname in enumerate(docnames)]
+
+
+def test_find_related():
+    a, b, c, d, e = entries('a', 'b', 'c', 'd', 'e')
+    tag = [a, c, d]
+    category = [a, b, c, d, e]
+    postings = [(2, tag), (1, category)]
+    # a and d share both the tag and the category with c; d is closer.
+    assert find_related(c, postings, 3) == (3, 0, 1)
+    assert find_related(c, postings, 1) == (3,)
+    assert find_related(c, postings, 0) == ()
+    assert find_related(a, [], 3) == ()
+
+
+def test_find_related_ties():
+    # Equally related and equally close in time: first by docname.
+    early, late = (0, 'z', 0), (2, 'a', 2)
+    same = [(1, 'b', 3), (1, 'a', 4)]
+    bucket = sorted([early, late] + same)
+    assert find_related((1, 'm', 9), [(1, bucket)], 4) == (4, 3, 2, 0)
+
+
+def test_find_related_window():
+    bucket = entries(*('p%03d' % i for i in range(100)))
+    article = bucket[50]
+    related = find_related(article, [(1, bucket)], 100)
+    assert len(related) == 2 * WINDOW
+    assert max(related) == 50 + WINDOW and min(related) == 50 - WINDOW
+
+
+def test_neighborhood():
+    bucket = entries(*('p%03d' % i for i in range(100)))
+    ids = neighborhood(bucket, bucket[50])
+    assert ids == list(range(50 - WINDOW - 1, 50 + WINDOW + 2))
+    assert neighborhood(bucket, (-1, '', 0)) == list(range(WINDOW + 2))
+    assert neighborhood([], bucket[0]) == []
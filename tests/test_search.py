@@ -0,0 +1,43 @@
+import io
+import json
+import os
+import re
+
+from chephren import search
+from chephren.search import shard_filename, tokenize, update_shards
+
+
+def test_tokenize():
+    assert tokenize(u'The Sphinx themes, and foo_bar!') == \
+        set([u'sphinx', u'themes', u'foo', u'bar'])
+    # Unicode punctuation separates words, as in blogsearch.js.
+    assert tokenize(u'na\xefve \u201cquotes\u201d\u2014caf\xe9\u2026 x') == \
+        set([u'na\xefve', u'quotes', u'caf\xe9'])
+
+
+def test_blogsearch_js_in_step():
+    path = os.path.join(os.path.dirname(search.__file__), 'static',
+                        'blogsearch.js')
+    with io.open(path, encoding='utf-8') as infile:
+        script = infile.read()
+    assert u'/[\\p{L}\\p{N}]{2,}/gu' in script
+    stopwords = re.search(r"stopwords: \(([^)]*)\)", script).group(1)
+    assert set(re.findall(r'\w+', stopwords)) == search.STOPWORDS
+
+
+def test_update_shards(tmpdir):
+    root = str(tmpdir)
+    docshards = {}
+    update_shards(root, docshards, {
+        'a': (u'A', 'a.html', [u'sphinx', u'python']),
+        'b': (u'B', 'b.html', [u'python']),
+    })
+    assert docshards == {'a': [u'py', u'sp'], 'b': [u'py']}
+
+    # Removing an article only rewrites the shards that held it.
+    written = update_shards(root, docshards, {'a': None})
+    assert written == 2
+    assert not os.path.exists(os.path.join(root, shard_filename(u'sp')))
+    with open(os.path.join(root, shard_filename(u'py'))) as infile:
+        assert json.load(infile) == {'terms': {'python': ['b']},
+                                     'docs': {'b': ['B', 'b.html']}}
@@ -0,0 +1,23 @@
+import os
+
+from chephren.serve import changed_files, inject_reload_script, snapshot
+
+
+def test_inject_reload_script():
+    html = inject_reload_script(b'<html><body><p>Hi</p></body></html>')
+    assert html.startswith(b'<html><body><p>Hi</p><script>')
+    assert html.endswith(b'</script>\n</body></html>')
+
+
+def test_snapshot_changes(tmpdir):
+    tmpdir.join('a.rst').write('a')
+    tmpdir.mkdir('_build').join('index.html').write('x')
+    before = snapshot(str(tmpdir))
+    assert list(before) == [os.path.join(str(tmpdir), 'a.rst')]
+
+    tmpdir.join('a.rst').write('changed')
+    tmpdir.join('b.rst').write('b')
+    tmpdir.join('_build', 'index.html').write('changed')
+    assert changed_files(before, snapshot(str(tmpdir))) == [
+        os.path.join(str(tmpdir), 'a.rst'),
+        os.path.join(str(tmpdir), 'b.rst')]
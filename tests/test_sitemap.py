@@ -0,0 +1,27 @@
+import io
+from datetime import datetime
+
+from chephren.sitemap import SitemapWriter, shard_filename
+
+
+def test_sitemap_writer():
+    out = io.StringIO()
+    sitemap = SitemapWriter(out)
+    sitemap.start()
+    sitemap.write_url(u'http://localhost:8000/a.html?x=1&y=2',
+                      datetime(2015, 1, 4, 15, 0))
+    sitemap.end()
+    assert out.getvalue() == u'''\
+<?xml version="1.0" encoding="utf-8"?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <url>
+    <loc>http://localhost:8000/a.html?x=1&amp;y=2</loc>
+    <lastmod>2015-01-04T15:00:00Z</lastmod>
+  </url>
+</urlset>
+'''
+
+
+def test_shard_filename():
+    assert shard_filename('sitemap.xml', 1) == 'sitemap-1.xml'
+    assert shard_filename('maps/sitemap.xml.gz', 2) == 'maps/sitemap-2.xml.gz'